@@ -0,0 +1 @@
+"""analysis and backtest scripts, run from the project root as modules (e.g. python -m analysis.correlation_test)"""
@@ -1,35 +1,24 @@
 """
 This code computes the IC of different factors and output results in csv files.
 depends on Factor class setup in params.py
+run from the project root: python -m analysis.correlation_test
 """
 
+import os
 import pandas as pd
 import numpy as np
 import scipy.stats
 import mysql.connector
 from mysql.connector import errorcode
 from scipy.stats.mstats import winsorize
-from params import config, query_date, query_status, Factor
-
-query_holding = (
-    """
-    select total.InnerCode, total.delta, mk.HKStkMV as mktcap, t3.ClosePrice/t2.ClosePrice - 1 as ret1, 
-    t4.ClosePrice/t2.ClosePrice - 1 as ret2,  t5.ClosePrice/t2.ClosePrice - 1 as ret3 from (
-	select InnerCode, sum(change_amount) as delta from AlternativeData.ChangeHoldAmountSM
-    where innerCode not in ({c}) and date between %s and  %s group by InnerCode having sum(change_amount) <>0 
-    ) total
-    inner join (Select InnerCode, ClosePrice  from jydb.QT_HKBefRehDQuote where tradingday =  %s) t2
-	on t2.InnerCode = total.InnerCode
-    inner join (Select InnerCode, ClosePrice  from jydb.QT_HKBefRehDQuote where tradingday = %s) t3
-	on t3.InnerCode = total.InnerCode
-    inner join (Select InnerCode, ClosePrice  from jydb.QT_HKBefRehDQuote where tradingday = %s) t4
-	on t4.InnerCode = total.InnerCode
-    inner join (Select InnerCode, ClosePrice  from jydb.QT_HKBefRehDQuote where tradingday = %s) t5
-	on t5.InnerCode = total.InnerCode
-    inner join (Select InnerCode, HKStkMV from jydb.QT_HKDailyQuoteIndex where tradingday = %s) mk 
-	on mk.InnerCode = total.InnerCode;
-    """
-)
+from analysis.params import config, Factor, analysis_dir
+from panel_store import InflowPanelStore
+from listing_index import ListingIndex
+from transforms import pct_rank
+from ic_engine import rank_ic
+from result_sink import ResultSink
+from forward_returns import load_quotes, holding_panel
+from query_cache import QueryCache
 
 try:
     cnx = mysql.connector.connect(**config)
@@ -41,19 +30,32 @@ except mysql.connector.Error as err:
     else:
         print(err)
 else:
-    # get trading days and dataframe for extracting banned stock list
-    tradeday_df = pd.read_sql(query_date, cnx)
-    ban_df = pd.read_sql(query_status, cnx, params=[tradeday_df.date.max().strftime("%Y-%m-%d")])
-    ban_df.start_date = pd.to_datetime(ban_df.start_date)
-    ban_df.end_date = pd.to_datetime(ban_df.end_date)
+    # update the local inflow panel and get trading days from it
+    panel = InflowPanelStore().update(cnx)
+    tradeday_df = panel.trading_days()
+
+    # listing intervals for extracting banned stock list
+    listing = ListingIndex.from_panel(panel)
+
+    # close prices and market caps of all trading days, fetched once for every horizon and lookback
+    # (chunks of past dates are read from the local query cache after the first run)
+    quote_cache = QueryCache()
+    close, mktcap = load_quotes(cnx, tradeday_df.date, cache=quote_cache)
+    print("quote cache:", quote_cache.stats())
 
     # start computing factor IC
     factor_names = ["delta", "neu", "absneu", "neuU", "neuD", "deltaU", "deltaD", "abstails", "absmiddle"]
+    # column of each factor, tails and middle are the neu factor on the tails/middle of the absneu ranking
+    factor_columns = {name: name for name in factor_names}
+    factor_columns.update({"abstails": "neu", "absmiddle": "neu"})
+    columns = sorted(set(factor_columns.values()))
     for n in [5, 10, 30]:
         factors = {}
         for name in factor_names:
             factors[name] = Factor(name)
         print("Processing {}-day inflow data".format(n))
+        # per-date factor values, checkpointed so an interrupted run resumes from the last stored date
+        sink = ResultSink(os.path.join(analysis_dir, 'correlations', 'checkpoint_{:d}d'.format(n)), every=50)
         for i in range(tradeday_df.shape[0]):
             if n < i < tradeday_df.shape[0] - 30 and tradeday_df.at[i, "total"] >= 5:
                 # get dates
@@ -65,23 +67,18 @@ else:
                 t4 = str(tradeday_df.at[i + 10, "date"])[:10]
                 t5 = str(tradeday_df.at[i + 30, "date"])[:10]
                 mk = str(tradeday_df.at[i - 3, "date"])[:10]
+                if sink.done(t1):
+                    continue
 
                 # get banned stock list
-                if i <= 60:
-                    ban_ls = ban_df.loc[ban_df.end_date <= tradeday_df.at[i + 60, "date"], 'code'].tolist()
-                elif i >= tradeday_df.shape[0] - 60:
-                    ban_ls = ban_df.loc[ban_df.start_date >= tradeday_df.at[i - 60, "date"], 'code'].tolist()
-                else:
-                    ban_ls = ban_df.loc[(ban_df.end_date <= tradeday_df.at[i + 60, "date"]) & (
-                                ban_df.start_date >= tradeday_df.at[i - 60, "date"]), 'code'].tolist()
-
-                if not ban_ls:
-                    ban_ls = ["0"]
-
-                # get data
-                data_df = pd.read_sql(query_holding.format(c=','.join(['%s'] * len(ban_ls))), cnx,
-                                      params=ban_ls + [total1, total2, t2, t3, t4, t5, mk])
-                # c=','.join(['%s'] * len(ban_ls))
+                ban_ls = listing.ban_list(i)
+
+                # get data: inflow sums from the local panel, forward returns from the loaded quotes
+                delta_df = panel.window(total1, total2, exclude=ban_ls)
+                delta_df = delta_df.loc[delta_df.delta != 0, ["InnerCode", "delta"]]
+                plan = pd.DataFrame([{"t2": t2, "t3": t3, "t4": t4, "t5": t5, "mk": mk}])
+                holding = holding_panel(close, mktcap, plan, {"ret1": "t3", "ret2": "t4", "ret3": "t5"})
+                data_df = pd.merge(delta_df, holding.drop(columns="key"), on="InnerCode")
 
                 # cleaning data
                 after_win = winsorize(data_df.delta, limits=[0.025, 0.025])
@@ -100,46 +97,30 @@ else:
 
                 data_df["ratio"] = data_df["delta"] / data_df["mktcap"]
 
-                data_df1 = data_df.loc[data_df.delta > 0, ["ret1", "ret2", "ret3", "delta", "mktcap_log"]]
-                data_df1.columns = ["ret1", "ret2", "ret3", "deltaU", "mktcap_log"]
-                regre_re = scipy.stats.linregress(data_df1["mktcap_log"], data_df1["deltaU"])
-                data_df1["neuU"] = data_df1["deltaU"] - regre_re[1] - regre_re[0] * data_df1["mktcap_log"]
-
-                data_df2 = data_df.loc[data_df.delta < 0, ["ret1", "ret2", "ret3", "delta", "mktcap_log"]]
-                data_df2.columns = ["ret1", "ret2", "ret3", "deltaD", "mktcap_log"]
-                regre_re = scipy.stats.linregress(data_df2["mktcap_log"], data_df2["deltaD"])
-                data_df2["neuD"] = data_df2["deltaD"] - regre_re[1] - regre_re[0] * data_df2["mktcap_log"]
-
-                data_df["neu_rank"] = data_df["neu"].rank(pct=True)
-                data_df["delta_rank"] = data_df["delta"].rank(pct=True)
-                data_df["absneu_rank"] = data_df["absneu"].rank(pct=True)
-
-                # if n == 30:
-                #     print(data_df2.shape[0])
-
-                for f in factors:
-                    if f == "neuU":
-                        factors[f].getIC(data_df1, f, t1)
-                    elif f == "neuD":
-                        factors[f].getIC(data_df2, f, t1)
-                    elif f == "deltaU":
-                        factors[f].getIC(data_df1, f, t1)
-                    elif f == "deltaD":
-                        factors[f].getIC(data_df2, f, t1)
-                    elif f == "tails":
-                        factors[f].getIC(data_df[(data_df.neu_rank<=0.1)|(data_df.neu_rank>=0.9)], "neu", t1)
-                    elif f == "middle":
-                        factors[f].getIC(data_df[(data_df.neu_rank>=0.1)&(data_df.neu_rank<=0.9)], "neu", t1)
-                    elif f == "abstails":
-                        factors[f].getIC(data_df[(data_df.absneu_rank <= 0.1) | (data_df.absneu_rank >= 0.9)], "neu", t1)
-                    elif f == "absmiddle":
-                        factors[f].getIC(data_df[(data_df.absneu_rank >= 0.1) & (data_df.absneu_rank <= 0.9)], "neu", t1)
-                    else:
-                        factors[f].getIC(data_df, f, t1)
-
-            # output results
-            for f in factors:
-                factors[f].outputIC(n)
+                # factors of the stocks with inflow (U) and outflow (D), nan for the other stocks
+                for side, sub in (("U", data_df.delta > 0), ("D", data_df.delta < 0)):
+                    regre_re = scipy.stats.linregress(data_df.loc[sub, "mktcap_log"], data_df.loc[sub, "delta"])
+                    data_df["delta" + side] = data_df["delta"].where(sub)
+                    neu = data_df["delta"] - regre_re[1] - regre_re[0] * data_df["mktcap_log"]
+                    data_df["neu" + side] = neu.where(sub)
+
+                data_df["absneu_rank"] = pct_rank(data_df["absneu"])
+                data_df["date"] = t1
+                sink.add(t1, data_df[["date", "ret1", "ret2", "ret3", "absneu_rank"] + columns])
+
+        # compute IC of all factors, horizons and dates at once (see ic_engine)
+        sink.checkpoint()
+        ic_panel = sink.frame()
+        tails = (ic_panel.absneu_rank <= 0.1) | (ic_panel.absneu_rank >= 0.9)
+        middle = (ic_panel.absneu_rank >= 0.1) & (ic_panel.absneu_rank <= 0.9)
+        ic_df = rank_ic(ic_panel, factor_columns, ["ret1", "ret2", "ret3"],
+                        masks={"abstails": tails.values, "absmiddle": middle.values})
+
+        # output results
+        for f in factors:
+            factors[f].setIC(ic_df)
+            factors[f].outputIC(n)
+        sink.clear()
 
         print("Process finished.")
     cnx.close()
@@ -1,6 +1,8 @@
 """
 This file stores some commonly-used variables for other files.
 """
+import os
+import transforms
 
 config = {
     'user': 'infoport',
@@ -10,22 +12,6 @@ config = {
     'raise_on_warnings': False
 }
 
-# count the number of stocks traded by mainland investor on each trade day
-query_date = (
-    '''
-    select date, sum(case when change_amount <> 0 then 1 else 0 end) as total from  AlternativeData.ChangeHoldAmountSM 
-    group by date
-    '''
-)
-
-query_status = (
-    """
-    Select code, min(date) as start_date, max(date) as end_date from AlternativeData.ChangeHoldAmountSM
-    group by code
-    having start_date != "2017-03-17" or end_date != %s;
-    """
-)
-
 query_HSI = (
     """
     SELECT tradingday as date, PrevClosePrice as close_price, changePCT FROM jydb.QT_OSIndexQuote
@@ -34,17 +20,14 @@ where IndexCode = %s and tradingday >= 20170317;
 )
 
 def myWinsorize(array, sig):
-    import numpy as np
-    array_mean = np.mean(array)
-    array_std = np.std(array)
-    win = lambda x: array_mean - sig * array_std if x < array_mean - sig * array_std else (
-        array_mean + sig * array_std if x > array_mean + sig * array_std else x)
-    afterWin = array.apply(win)
-    return afterWin
+    return transforms.winsorize(array, sig)
 
 
 path = r'C:\Users\arizonazhang\OneDrive - hkaift\research\capflow'
 
+# output folders (correlations, portfolios, long_short) are in the analysis folder whatever the working directory
+analysis_dir = os.path.dirname(os.path.abspath(__file__))
+
 class Factor:
     def __init__(self, name):
         self.name = name
@@ -58,15 +41,18 @@ class Factor:
         r3, p3 = scipy.stats.spearmanr(df[["ret3", colname]])
         self.values[t] = [r1, p1, r2, p2, r3, p3]
 
-    def getSortedReturn(self, df, n, m, addMktcap=False):
-        grouping = lambda x, size=5: int(x * size) + 1 if x < 1 else size
+    def setIC(self, ic_df, horizons=("ret1", "ret2", "ret3")):
+        """store the rank IC of this factor on every date from the output of ic_engine.rank_ic"""
+        df = ic_df[ic_df.factor == self.name].pivot(index="date", columns="horizon", values=["ic", "p"])
+        for t, row in df.iterrows():
+            self.values[t] = [v for h in horizons for v in (row[("ic", h)], row[("p", h)])]
 
-        df["factor_rank"] = df[self.name].rank(pct=True)
-        df["factor_rank"] = df["factor_rank"].apply(grouping)
+    def getSortedReturn(self, df, n, m, addMktcap=False):
+        # stocks without a factor value (or market cap) have no bucket and are left out of the averages
+        df["factor_rank"] = transforms.quantile_bucket(df[self.name], 5).astype("Int64")
 
         if addMktcap:
-            df["mktcap_rank"] = df.mktcap.rank(pct=True)
-            df["mktcap_rank"] = df["mktcap_rank"].apply(grouping, args=(3,))
+            df["mktcap_rank"] = transforms.quantile_bucket(df.mktcap, 3).astype("Int64")
         else:
             df["mktcap_rank"] = 0
 
@@ -81,27 +67,14 @@ class Factor:
         import pandas as pd
         pd.DataFrame.from_dict(self.values, orient="index",
                                columns=["corr_5", "p_5", "corr_10", "p_10", "corr_30", "p_30"]).to_csv(
-            r'.\correlations\correlation_{}_{:d}d_v4.csv'.format(self.name, n))
+            os.path.join(analysis_dir, 'correlations', 'correlation_{}_{:d}d_v4.csv'.format(self.name, n)))
 
     def outputRet(self):
         import pandas as pd
-        loc = r".\portfolios\portfolio_sort_{}.csv".format(self.name)
+        loc = os.path.join(analysis_dir, 'portfolios', 'portfolio_sort_{}.csv'.format(self.name))
         try:
             pd.concat(self.sorts, axis=0).to_csv(loc)
             print("File saved.")
         except IOError as e:
             if e == PermissionError:
                 print("Please close destination file.")
-
-
-def getBanList(ban_df, tradeday_df, i):
-    if i <= 60:
-        ban_ls = ban_df.loc[ban_df.end_date <= tradeday_df.at[i + 60, "date"], 'code'].tolist()
-    elif i >= tradeday_df.shape[0] - 60:
-        ban_ls = ban_df.loc[ban_df.start_date >= tradeday_df.at[i - 60, "date"], 'code'].tolist()
-    else:
-        ban_ls = ban_df.loc[(ban_df.end_date <= tradeday_df.at[i + 60, "date"]) & (
-                ban_df.start_date >= tradeday_df.at[i - 60, "date"]), 'code'].tolist()
-    if not ban_ls:
-        ban_ls = ["0"]
-    return ban_ls
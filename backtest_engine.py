@@ -0,0 +1,108 @@
+"""
+this module simulates the long-short backtest of analysis/long_short_backtest.py for a whole factor panel:
+at every rebalance the stocks ranked in the top (bottom) quantile of a factor are bought (sold) with equal amounts,
+and the capital that stays in the portfolio saves transaction cost (rate_long, rate_short) that is reinvested;
+selection, overlaps and portfolio statistics are computed as (rebalance x stock) arrays for all rebalances at once,
+only the capital recursion itself loops over rebalances, with the held positions kept in a PositionBook
+"""
+import numpy as np
+import pandas as pd
+from transforms import pct_rank
+from position_book import PositionBook
+
+columns = ["date", "strategy", "M", "net_ret", "net_long", "net_short", "no_long", "no_short", "remove_long",
+           "remove_short", "mktcap_long", "mktcap_short"]
+
+
+def _mktcap_level(selected, mktcap, present):
+    """(avg market cap of selected stocks - avg market cap of all stocks) / std of all stocks (ddof=1)"""
+    n = present.sum(axis=1)
+    mk = np.where(present, mktcap, 0)
+    mean = mk.sum(axis=1) / n
+    std = np.sqrt(np.where(present, (mktcap - mean[:, None]) ** 2, 0).sum(axis=1) / (n - 1))
+    return ((np.where(selected, mktcap, 0).sum(axis=1) / selected.sum(axis=1)) - mean) / std
+
+
+def _simulate_one(long, short, growth, rate_long, rate_short):
+    """
+    capital recursion of one strategy
+    long, short: selected stocks at each rebalance, growth: 1 + return of each stock until the next rebalance
+    """
+    cost = 1 + rate_long + rate_short
+    # selected stocks (column positions) and their growth at each rebalance
+    selected_long, growth_long = _selections(long, growth)
+    selected_short, growth_short = _selections(short, growth)
+
+    rows = []
+    M = 1.0
+    book_long, book_short = PositionBook(), PositionBook()
+    for k in range(len(long)):
+        # update total capital, amounts of the last rebalance grow with the stock returns
+        cap_long, cap_short = book_long.total(), book_short.total()
+        net = ((cap_long - cap_short) / M, cap_long / M - 1, cap_short / M - 1)
+        M += cap_long - cap_short
+
+        # capital of positions that stay in the portfolio
+        n_long, n_short = len(selected_long[k]), len(selected_short[k])
+        target_long, target_short = M / n_long / cost, M / n_short / cost
+        stay, remove_long, _ = book_long.diff(PositionBook(selected_long[k], is_sorted=True))
+        stay_long = np.minimum(book_long.amounts[stay], target_long).sum()
+        stay, remove_short, _ = book_short.diff(PositionBook(selected_short[k], is_sorted=True))
+        stay_short = np.minimum(book_short.amounts[stay], target_short).sum()
+        saved = (rate_long * stay_long + rate_short * stay_short) / cost
+
+        # new equal-weighted positions, grown until the next rebalance
+        book_long = PositionBook.equal(selected_long[k], target_long + saved / n_long, is_sorted=True)
+        book_long = book_long.grow(growth_long[k])
+        book_short = PositionBook.equal(selected_short[k], target_short + saved / n_short, is_sorted=True)
+        book_short = book_short.grow(growth_short[k])
+        rows.append((M,) + net + (n_long, n_short, remove_long, remove_short))
+    return rows
+
+
+def _selections(selected, growth):
+    """column positions of the selected stocks of each row (sorted) and their growth"""
+    r, c = np.nonzero(selected)
+    split = np.cumsum(np.bincount(r, minlength=len(selected)))[:-1]
+    return np.split(c, split), np.split(growth[r, c], split)
+
+
+def simulate(panel, strategies, top=0.95, bottom=0.05, rate_long=0.0015, rate_short=0.0025, labels=None):
+    """
+    run the backtest of every strategy over the panel
+    panel: one row per (date, Code) with the forward return 'ret', 'mktcap' and one column per strategy (factor values)
+    labels: extra constant columns inserted after date (e.g. {'n': 10})
+    returns one row per (date, strategy) with the columns of long_short/return_v2_*.csv
+    """
+    dates = np.sort(panel['date'].unique())
+    codes = np.sort(panel['Code'].unique())
+    r = np.searchsorted(dates, panel['date'].values)
+    c = np.searchsorted(codes, panel['Code'].values)
+
+    def matrix(col):
+        m = np.full((len(dates), len(codes)), np.nan)
+        m[r, c] = panel[col].values
+        return m
+
+    present = np.zeros((len(dates), len(codes)), dtype=bool)
+    present[r, c] = True
+    growth = np.nan_to_num(1 + matrix('ret'))
+    mktcap = matrix('mktcap')
+
+    out = []
+    with np.errstate(invalid='ignore', divide='ignore'):
+        for s in strategies:
+            rank = pct_rank(matrix(s), mask=present)
+            long, short = rank >= top, rank <= bottom
+            sim = pd.DataFrame(_simulate_one(long, short, growth, rate_long, rate_short), columns=columns[2:-2])
+            sim.insert(0, 'date', dates)
+            sim.insert(1, 'strategy', s)
+            sim['mktcap_long'] = _mktcap_level(long, mktcap, present)
+            sim['mktcap_short'] = _mktcap_level(short, mktcap, present)
+            out.append(sim)
+
+    # same order as the backtest scripts: strategies within each rebalance date
+    result = pd.concat(out).sort_values('date', kind='stable').reset_index(drop=True)
+    for i, (name, value) in enumerate((labels or {}).items()):
+        result.insert(1 + i, name, value)
+    return result
@@ -0,0 +1,258 @@
+"""
+this module benchmarks the main steps of the project on a synthetic database (see synthetic_db):
+get_factor_data, Selector, Manager / MultiManager / StateManager return computation, the return backfill,
+the mysql and mongo upload helpers, the local inflow panel and the long-short backtest;
+every scenario is run `repeat` times (the first run starts from empty local stores), latency, throughput and the
+queries / rows counted by instrumentation are stored as one json file per run in logs/benchmarks,
+so runs made before and after a change can be compared
+
+usage: python benchmark.py --stocks 500 --days 500 --repeat 3 --label my-change
+       python benchmark.py --compare <run id> <run id>
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import subprocess
+import tempfile
+import numpy as np
+import pandas as pd
+import synthetic_db
+import inflow_factor_class as ifc
+from instrumentation import metrics, stage
+from panel_store import InflowPanelStore
+from listing_index import ListingIndex
+from manager_state import StateManager
+from return_backfill import backfill_returns
+from forward_returns import load_quotes
+from sweep import build_factors
+from backtest_engine import simulate
+
+result_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'logs', 'benchmarks')
+
+strategies = ['pure', 'neu', 'absneu']
+
+
+class Context:
+    """synthetic session and the dates used by the scenarios"""
+
+    def __init__(self, session):
+        self.session = session
+        days = ifc.read_mysql("select distinct tradingday from jydb.QT_HKDailyQuoteIndex order by tradingday",
+                              session=session)
+        self.days = pd.to_datetime(days['tradingday']).dt.strftime("%Y-%m-%d").tolist()
+        reb = ifc.read_mysql("select distinct date from InflowFactor order by date", session=session)
+        self.reb_dates = pd.to_datetime(reb['date']).dt.strftime("%Y-%m-%d").tolist()
+        if len(self.reb_dates) < 3:
+            raise ValueError("the synthetic database needs at least three rebalancing dates")
+        # a trading day a few days after the last but one rebalancing (returns need two rebalancing dates)
+        after = [d for d in self.days if d > self.reb_dates[-2]]
+        self.cal_date = after[min(3, len(after) - 1)]
+        self.store_dir = tempfile.mkdtemp(prefix='inflow_bench_')
+        self.panel = None
+
+    def close(self):
+        shutil.rmtree(self.store_dir, ignore_errors=True)
+
+
+def bench_get_factor_data(ctx):
+    """factor data of the last four rebalancing dates"""
+    dates = ctx.reb_dates[-4:]
+    for date in dates:
+        ifc.get_factor_data(date, session=ctx.session)
+    return len(dates)
+
+
+def bench_selector(ctx):
+    """portfolios of the three strategies on the last rebalancing date (one factor fetch shared by the strategies)"""
+    cache = ifc.FactorCache()
+    for strategy in strategies:
+        ifc.Selector(strategy, ctx.reb_dates[-1], session=ctx.session, cache=cache)
+    return len(strategies)
+
+
+def bench_manager(ctx):
+    """returns of the three strategies, one Manager per strategy"""
+    for strategy in strategies:
+        ifc.Manager(strategy, ctx.cal_date, session=ctx.session)
+    return len(strategies)
+
+
+def bench_multi_manager(ctx):
+    """returns of the three strategies with one MultiManager"""
+    ifc.MultiManager(strategies, ctx.cal_date, session=ctx.session)
+    return len(strategies)
+
+
+def bench_upload_mysql(ctx, n_dates=100):
+    """replace returns of n_dates days (dates after the synthetic data, so the other scenarios are not affected)"""
+    dates = pd.bdate_range('2100-01-01', periods=n_dates).strftime("%Y-%m-%d")
+    perf = pd.DataFrame([(d, s, side) for d in dates for s in strategies for side in ['long', 'short', 'long-short']],
+                        columns=['date', 'strategy', 'recommendation'])
+    perf['daily_ret'] = np.random.default_rng(0).normal(0, 0.01, len(perf))
+    perf['cumulative_value'] = 1 + perf['daily_ret']
+    ifc.upload_return(perf, session=ctx.session)
+    return len(perf)
+
+
+def bench_upload_mongo(ctx, n_docs=1000):
+    """upsert n_docs performance documents through a MongoSink"""
+    with ifc.MongoSink(session=ctx.session) as sink:
+        for i in range(n_docs):
+            sink.add({'portfolio_id': i % 3 + 1, 'trading_date': f"2100-{i // 28 % 12 + 1:02d}-{i % 28 + 1:02d}",
+                      'daily_return': 0.01, 'cumulative_return': 1.01}, 'portfolio_performance')
+    return n_docs
+
+
+def bench_panel_store(ctx):
+    """bulk build of the local inflow panel from ChangeHoldAmountSM"""
+    ctx.panel = InflowPanelStore(os.path.join(ctx.store_dir, 'inflow_panel')).build(ctx.session.engine)
+    return len(ctx.panel.dates)
+
+
+def bench_backtest(ctx, n=5, m=10):
+    """
+    long-short backtest of long_short_backtest.py (inflow sums of n days, rebalancing every m days)
+    on the local panel, with the quotes of all trading days loaded once (the path of sweep.py)
+    """
+    if ctx.panel is None:
+        bench_panel_store(ctx)
+    listing = ListingIndex.from_panel(ctx.panel, os.path.join(ctx.store_dir, 'listing_index.npz'))
+    close, mktcap = load_quotes(ctx.session.engine, ctx.panel.trading_days().date)
+    factors = build_factors(ctx.panel, listing, close, mktcap, n, m, lag=1, min_mktcap=5000000000)
+    simulate(factors, ["delta", "neu", "absneu"], labels={"n": n})
+    return factors['date'].nunique()
+
+
+def bench_state_manager(ctx):
+    """returns of the three strategies from their persisted states (the first run rebuilds the states)"""
+    StateManager(strategies, ctx.cal_date, session=ctx.session)
+    return len(strategies)
+
+
+def bench_backfill(ctx):
+    """returns of all days since the last but one rebalancing date, computed from one price matrix"""
+    perf = backfill_returns(ctx.reb_dates[-2], ctx.cal_date, strategies, session=ctx.session)
+    return perf['date'].nunique()
+
+
+# name -> scenario, run in this order (backtest reuses the panel built by panel_store)
+scenarios = {
+    'get_factor_data': bench_get_factor_data,
+    'selector': bench_selector,
+    'manager': bench_manager,
+    'multi_manager': bench_multi_manager,
+    'state_manager': bench_state_manager,
+    'backfill': bench_backfill,
+    'upload_mysql': bench_upload_mysql,
+    'upload_mongo': bench_upload_mongo,
+    'panel_store': bench_panel_store,
+    'backtest': bench_backtest,
+}
+
+
+def _git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except OSError:
+        return ''
+
+
+def run_scenario(ctx, name, repeat=3):
+    """run the scenario `repeat` times, returns its latency, throughput and query statistics"""
+    func = scenarios[name]
+    seconds, items = [], 0
+    metrics.reset()
+    for _ in range(repeat):
+        start = time.perf_counter()
+        with stage(f"benchmark.{name}"):
+            items = func(ctx)
+        seconds.append(time.perf_counter() - start)
+    totals = metrics.snapshot().get(f"benchmark.{name}", {})
+    median = float(np.median(seconds))
+    return {'items': items, 'seconds': seconds, 'first': seconds[0], 'median': median, 'min': min(seconds),
+            'items_per_second': items / median if median > 0 else None,
+            'queries': totals.get('queries', 0) / repeat, 'rows': totals.get('rows', 0) / repeat}
+
+
+def run(names=None, n_stocks=500, n_days=500, repeat=3, seed=0, label='', path=None, save=True):
+    """
+    build (or reuse) the synthetic database and run the scenarios (all if names is None),
+    returns the results and writes them to logs/benchmarks/<run id>.json if save
+    """
+    names = names or list(scenarios)
+    db_path = synthetic_db.build(path, n_stocks=n_stocks, n_days=n_days, seed=seed)
+    session = synthetic_db.SyntheticSession(db_path)
+    session.clear_stores()
+    ctx = Context(session)
+
+    run_id = time.strftime("%Y%m%d-%H%M%S") + (f"_{label}" if label else '')
+    result = {'run_id': run_id, 'label': label, 'time': time.strftime("%Y-%m-%dT%H:%M:%S"),
+              'commit': _git_commit(), 'python': platform.python_version(), 'pandas': pd.__version__,
+              'numpy': np.__version__, 'n_stocks': n_stocks, 'n_days': n_days, 'seed': seed, 'repeat': repeat,
+              'scenarios': {}}
+    try:
+        for name in names:
+            ifc.print_with_time(f"Benchmark [{name}]")
+            result['scenarios'][name] = run_scenario(ctx, name, repeat)
+    finally:
+        ctx.close()
+        session.close()
+        metrics.reset()
+
+    if save:
+        os.makedirs(result_dir, exist_ok=True)
+        with open(os.path.join(result_dir, run_id + '.json'), 'w') as f:
+            json.dump(result, f, indent=2)
+    return result
+
+
+def load_run(run_id):
+    """results of a stored run (run id or path of the json file)"""
+    path = run_id if run_id.endswith('.json') else os.path.join(result_dir, run_id + '.json')
+    with open(path) as f:
+        return json.load(f)
+
+
+def summary(result):
+    """one row per scenario of a run"""
+    rows = [{'scenario': name, **{k: r[k] for k in ['items', 'first', 'median', 'min', 'items_per_second',
+                                                     'queries', 'rows']}}
+            for name, r in result['scenarios'].items()]
+    return pd.DataFrame(rows).set_index('scenario')
+
+
+def compare(base, new):
+    """median latency of the scenarios of two runs (run ids) and the speedup of new over base"""
+    a, b = summary(load_run(base)), summary(load_run(new))
+    table = pd.DataFrame({'base': a['median'], 'new': b['median']})
+    table['speedup'] = table['base'] / table['new']
+    table['queries_base'] = a['queries']
+    table['queries_new'] = b['queries']
+    return table
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="benchmark the project on a synthetic database")
+    parser.add_argument('--stocks', type=int, default=500)
+    parser.add_argument('--days', type=int, default=500)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--label', default='')
+    parser.add_argument('--scenario', action='append', choices=list(scenarios),
+                        help="scenario to run (repeatable), all by default")
+    parser.add_argument('--compare', nargs=2, metavar=('BASE', 'NEW'), help="compare two stored runs")
+    args = parser.parse_args()
+
+    pd.set_option('display.width', 200)
+    if args.compare:
+        print(compare(*args.compare))
+        sys.exit()
+    result = run(args.scenario, n_stocks=args.stocks, n_days=args.days, repeat=args.repeat, seed=args.seed,
+                 label=args.label)
+    print(f"run {result['run_id']}")
+    print(summary(result))
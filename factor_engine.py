@@ -0,0 +1,87 @@
+"""
+this module computes the inflow factors (pure, neu, absneu) for a whole range of reference dates at once;
+it follows get_factor_data in inflow_factor_class step by step, but every step is done on
+(reference date x stock) matrices instead of one reference date at a time
+"""
+import numpy as np
+import pandas as pd
+from inflow_factor_class import read_mysql
+from panel_store import InflowPanelStore
+from transforms import winsorize, zscore, residualize
+from trading_calendar import TradingCalendar
+
+query_mktcap = """
+SELECT p.tradingday as date, p.InnerCode, mk.HKStkMV as mktcap FROM jydb.QT_HKBefRehDQuote p
+inner join jydb.QT_HKDailyQuoteIndex mk on mk.InnerCode = p.InnerCode and mk.tradingday = p.tradingday
+where p.tradingday between %s and %s;
+"""
+
+
+def load_mktcap(start_date, end_date, session=None):
+    """load market cap of all stocks between start_date and end_date as a (trading day x InnerCode) dataframe"""
+    df = read_mysql(query_mktcap, start_date, end_date, session=session)
+    df['date'] = pd.to_datetime(df['date'])
+    df['InnerCode'] = df['InnerCode'].astype(np.int64)
+    return df.pivot_table(index='date', columns='InnerCode', values='mktcap', aggfunc='last')
+
+
+def compute_factor_panel(store, mktcap, ref_dates, sig=3.5, min_mktcap=5000000000, horizon=14):
+    """
+    compute pure, neu and absneu for every reference date in ref_dates
+    store: loaded InflowPanelStore, mktcap: (trading day x InnerCode) dataframe from load_mktcap
+    returns a long dataframe with one row per (ref_date, InnerCode) in the investable universe
+    """
+    dates, codes = store.dates, store.codes
+
+    # first trading day of each two-week window (taken from the market cap calendar, as in get_factor_data)
+    ref = pd.DatetimeIndex(ref_dates).values.astype('datetime64[D]')
+    mk_dates = mktcap.index.values.astype('datetime64[D]')
+    mk = mktcap.reindex(columns=codes).values.astype(np.float64)
+    trade_start = TradingCalendar.from_dates(mk_dates).window_start(ref, horizon)
+    has_start = ~np.isnat(trade_start)
+    ref, trade_start = ref[has_start], trade_start[has_start]
+    k = np.searchsorted(mk_dates, trade_start)
+
+    # sum of inflow between the window start and the reference date (from the prefix sums of the store)
+    i = np.searchsorted(dates, trade_start, side='left')
+    j = np.searchsorted(dates, ref, side='right')
+    pure, cnt = store.window_sums(i, j)
+
+    # exclude stocks whose first record is within the last 60 trading days
+    listed = store.listed(j, 60)
+
+    cap = mk[k]
+    with np.errstate(invalid='ignore'):
+        universe = (cnt > 0) & listed & (cap >= min_mktcap)
+
+    # winsorize and standardization (rows are reference dates)
+    pure = zscore(winsorize(pure, sig, mask=universe))
+    cap = winsorize(cap, sig, mask=universe)
+    cap_log = np.log(cap)
+
+    # neutralized and absolute neutralized factors
+    neu = residualize(pure, cap_log)
+    absneu = residualize(np.abs(pure), cap_log) * np.where(pure > 0, 1, -1)
+
+    r, c = np.nonzero(universe)
+    return pd.DataFrame({'ref_date': pd.DatetimeIndex(ref[r]),
+                         'start_date': pd.DatetimeIndex(trade_start[r]),
+                         'InnerCode': codes[c],
+                         'mktcap': cap[r, c],
+                         'mktcap_log': cap_log[r, c],
+                         'pure': pure[r, c],
+                         'neu': neu[r, c],
+                         'absneu': absneu[r, c]})
+
+
+def get_factor_panel(start_date, end_date, store=None, horizon=14, session=None):
+    """
+    compute factors for every trading day between start_date and end_date using the local inflow panel
+    (the panel has to be up to date, see InflowPanelStore.update)
+    """
+    if store is None:
+        store = InflowPanelStore().load()
+    i, j = store.date_range(start_date, end_date)
+    mk_start = pd.to_datetime(start_date) - np.timedelta64(horizon - 1, "D")
+    mktcap = load_mktcap(mk_start.strftime("%Y-%m-%d"), end_date, session=session)
+    return compute_factor_panel(store, mktcap, store.dates[i:j], horizon=horizon)
@@ -0,0 +1,90 @@
+"""
+this module builds forward-return panels for the analysis scripts:
+close prices and market caps of every date needed by a run are fetched with a few set-based queries
+(one per chunk of dates) and the returns of all anchor dates and horizons are computed client-side,
+instead of one query per anchor date that self-joins jydb.QT_HKBefRehDQuote once per horizon
+"""
+import numpy as np
+import pandas as pd
+from prefetch import prefetch
+
+query_close = """
+select tradingday as date, InnerCode, ClosePrice as close_price from jydb.QT_HKBefRehDQuote where tradingday in ({d})
+"""
+
+query_mktcap = """
+select tradingday as date, InnerCode, HKStkMV as mktcap from jydb.QT_HKDailyQuoteIndex where tradingday in ({d})
+"""
+
+
+def _load(query, con, dates, chunk_size, workers, cache=None):
+    """
+    run the query for each chunk of dates and pivot the result into a (date x InnerCode) dataframe,
+    the next chunks are fetched while the current one is converted
+    """
+    def fetch(chunk):
+        sql = query.format(d=','.join(['%s'] * len(chunk)))
+        if cache is not None:
+            return cache.read_sql(sql, con, chunk)
+        return pd.read_sql(sql, con, params=tuple(chunk))
+
+    frames = []
+    chunks = [dates[k:k + chunk_size] for k in range(0, len(dates), chunk_size)]
+    for _, df in prefetch(chunks, fetch, depth=workers, workers=workers):
+        df['date'] = pd.to_datetime(df['date'])
+        df['InnerCode'] = df['InnerCode'].astype(np.int64)
+        df[df.columns[-1]] = df[df.columns[-1]].astype(float)
+        frames.append(df)
+    df = pd.concat(frames, ignore_index=True)
+    return df.pivot_table(index='date', columns='InnerCode', values=df.columns[-1], aggfunc='last')
+
+
+def load_quotes(con, dates, chunk_size=200, workers=1, cache=None):
+    """
+    close prices and market caps of all stocks on the given dates,
+    con is any connection accepted by pd.read_sql (workers > 1 fetches chunks concurrently and needs a connection
+    pool such as session.engine), chunks are read through cache if a QueryCache is given
+    (chunks start from the first date, so the chunks of past dates are the same in every run);
+    returns two (date x InnerCode) dataframes with the same columns
+    """
+    dates = sorted({str(d)[:10] for d in dates})
+    close = _load(query_close, con, dates, chunk_size, workers, cache)
+    mktcap = _load(query_mktcap, con, dates, chunk_size, workers, cache)
+    codes = close.columns.union(mktcap.columns)
+    return close.reindex(columns=codes), mktcap.reindex(columns=codes)
+
+
+def holding_panel(close, mktcap, plan, horizons, base='t2', mktcap_date='mk', min_mktcap=None, min_price=None):
+    """
+    forward returns and market cap of the stocks on every row of plan, same as one query_holding per row
+    plan: dataframe with one row per anchor and the dates used by it: base (price the returns start from),
+    the dates of horizons (dict return column -> plan column) and mktcap_date
+    stocks need a close price on all dates and a market cap (inner joins), filtered by
+    market cap >= min_mktcap and base close price >= min_price if given
+    returns a long dataframe with the plan index as 'key', InnerCode, mktcap and the return columns
+    """
+    def rows(col):
+        return close.index.get_indexer(pd.to_datetime(plan[col]))
+
+    # an extra all-nan row for dates without quotes
+    C = np.vstack([close.values, np.full((1, close.shape[1]), np.nan)])
+    MK = np.vstack([mktcap.values, np.full((1, mktcap.shape[1]), np.nan)])
+    base_close = C[rows(base)]
+    cap = MK[mktcap.index.get_indexer(pd.to_datetime(plan[mktcap_date]))]
+
+    valid = ~np.isnan(base_close) & ~np.isnan(cap)
+    rets = {}
+    with np.errstate(invalid='ignore', divide='ignore'):
+        for ret, col in horizons.items():
+            rets[ret] = C[rows(col)] / base_close - 1
+            valid &= ~np.isnan(rets[ret])
+        if min_mktcap is not None:
+            valid &= cap >= min_mktcap
+        if min_price is not None:
+            valid &= base_close >= min_price
+
+    r, c = np.nonzero(valid)
+    out = pd.DataFrame({'key': plan.index.values[r], 'InnerCode': close.columns.values[c], 'mktcap': cap[r, c]})
+    for ret in horizons:
+        out[ret] = rets[ret][r, c]
+    return out
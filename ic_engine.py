@@ -0,0 +1,65 @@
+"""
+this module computes rank IC (spearman correlation between factor values and forward returns) of many factors and
+return horizons over a whole (date, stock) panel at once:
+each factor and return column is ranked once within every date, and the correlations of all dates are
+accumulated with grouped sums instead of one scipy.stats.spearmanr call per factor, horizon and date
+"""
+import numpy as np
+import pandas as pd
+import scipy.stats
+from transforms import pct_rank
+
+
+def _group_corr(x, y, g, n):
+    """pearson correlation and number of observations of x and y within each group"""
+    cnt = np.bincount(g, minlength=n)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        dx = x - (np.bincount(g, weights=x, minlength=n) / cnt)[g]
+        dy = y - (np.bincount(g, weights=y, minlength=n) / cnt)[g]
+        sxy = np.bincount(g, weights=dx * dy, minlength=n)
+        sxx = np.bincount(g, weights=dx * dx, minlength=n)
+        syy = np.bincount(g, weights=dy * dy, minlength=n)
+        return sxy / np.sqrt(sxx * syy), cnt
+
+
+def rank_ic(panel, factors, returns, by='date', masks=None):
+    """
+    rank IC of every factor and return column on every date
+    panel: long dataframe with one row per (date, stock)
+    factors: list of factor columns, or dict factor name -> column (several factors can use one column with
+    different masks, e.g. {'tails': 'neu'})
+    returns: list of forward return columns (horizons)
+    masks: dict factor name -> boolean array of the rows used for that factor (e.g. tails of the ranking)
+    rows with a nan factor or return are left out; returns a long dataframe with the columns
+    [by, factor, horizon, ic, t, p, n], t and p are the t-statistic and two-sided p-value of scipy.stats.spearmanr
+    """
+    if not isinstance(factors, dict):
+        factors = {f: f for f in factors}
+    masks = masks or {}
+    g, keys = pd.factorize(panel[by])
+    n_groups = len(keys)
+    complete = panel[list(returns)].notna().all(axis=1).values
+
+    out = []
+    for name, col in factors.items():
+        valid = complete & panel[col].notna().values
+        if name in masks:
+            valid &= np.asarray(masks[name], dtype=bool)
+        rows = np.flatnonzero(valid)
+        if not len(rows):
+            continue
+        x = np.asarray(pct_rank(panel[col].values[rows], groups=g[rows]), dtype=np.float64)
+        for ret in returns:
+            y = np.asarray(pct_rank(panel[ret].values[rows], groups=g[rows]), dtype=np.float64)
+            r, cnt = _group_corr(x, y, g[rows], n_groups)
+            has = cnt > 0
+            out.append(pd.DataFrame({by: keys[has], 'factor': name, 'horizon': ret, 'ic': r[has], 'n': cnt[has]}))
+
+    result = pd.concat(out, ignore_index=True) if out else \
+        pd.DataFrame(columns=[by, 'factor', 'horizon', 'ic', 'n'])
+    dof = result['n'].astype(np.float64) - 2
+    with np.errstate(invalid='ignore', divide='ignore'):
+        result['t'] = result['ic'] * np.sqrt(dof / ((1 - result['ic']) * (1 + result['ic'])))
+        result['p'] = 2 * scipy.stats.t.sf(np.abs(result['t']), dof)
+    return result[[by, 'factor', 'horizon', 'ic', 't', 'p', 'n']]
+
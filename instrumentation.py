@@ -0,0 +1,159 @@
+"""
+this module records per-stage metrics of the scheduled jobs: wall time, number of calls, queries, rows and bytes
+(e.g. get_factor_data sub-steps, Manager.get_*, replace_into_mysql, mongo uploads);
+stages can be nested, queries and rows are counted in every stage that is open when they happen (work handed to
+worker threads through run_parallel or prefetch is counted in the stages of the thread that started it),
+metrics of a job are exported as one json line per job run and as a prometheus textfile
+(for the node exporter textfile collector)
+"""
+import os
+import json
+import time
+import threading
+from contextlib import contextmanager
+from functools import wraps
+
+log_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'logs')
+json_path = os.path.join(log_dir, 'metrics.jsonl')
+textfile_path = os.path.join(log_dir, 'inflow_factor.prom')
+
+fields = ('calls', 'seconds', 'queries', 'rows', 'bytes')
+
+
+class Metrics:
+    """totals of each stage since the last reset, shared by all threads"""
+
+    def __init__(self):
+        self.stages = {}
+        self.lock = threading.Lock()
+        self.local = threading.local()
+
+    def _open(self):
+        if not hasattr(self.local, 'stack'):
+            self.local.stack = []
+        return self.local.stack
+
+    def _add(self, name, **values):
+        with self.lock:
+            totals = self.stages.setdefault(name, dict.fromkeys(fields, 0))
+            for k, v in values.items():
+                totals[k] += v
+
+    @contextmanager
+    def stage(self, name):
+        """time the block as stage `name`"""
+        stack = self._open()
+        stack.append(name)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            stack.pop()
+            self._add(name, calls=1, seconds=time.perf_counter() - start)
+
+    def timed(self, name):
+        """decorator: time every call of the function as stage `name`"""
+        def decorator(func):
+            @wraps(func)
+            def wrapper(*args, **kwargs):
+                with self.stage(name):
+                    return func(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def carry(self, func):
+        """
+        func running inside the stages open in this thread when carry is called, for work handed to other threads
+        (the stage stack is per thread, so queries of a worker are otherwise not counted in the stages of its caller)
+        """
+        parent = list(self._open())
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            stack = self._open()
+            depth = len(stack)
+            stack.extend(parent)
+            try:
+                return func(*args, **kwargs)
+            finally:
+                del stack[depth:]
+        return wrapper
+
+    def record(self, queries=1, rows=0, nbytes=0):
+        """count a query (or an upload) with the rows and bytes it moved in all open stages"""
+        for name in set(self._open()):
+            self._add(name, queries=queries, rows=rows, bytes=nbytes)
+
+    def reset(self):
+        with self.lock:
+            self.stages = {}
+
+    def snapshot(self):
+        with self.lock:
+            return {name: dict(totals) for name, totals in self.stages.items()}
+
+    def write_json(self, job, path=None):
+        """append the metrics of the job run as one json line"""
+        path = path or json_path
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        line = {'job': job, 'time': time.strftime("%Y-%m-%dT%H:%M:%S"), 'stages': self.snapshot()}
+        with open(path, 'a') as f:
+            f.write(json.dumps(line) + '\n')
+
+    def write_prometheus(self, job, path=None):
+        """
+        write the metrics of the last run of every job in the prometheus text format,
+        the file is replaced as a whole so the collector never reads a partial file
+        """
+        path = path or textfile_path
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        runs, last_run = _read_runs(path)
+        runs[job] = self.snapshot()
+        last_run[job] = time.time()
+        lines = []
+        for field in fields:
+            metric = f"inflow_stage_{field}"
+            lines.append(f"# TYPE {metric} gauge")
+            for run_job, run_stages in sorted(runs.items()):
+                for name, totals in sorted(run_stages.items()):
+                    lines.append(f'{metric}{{job="{run_job}",stage="{name}"}} {totals[field]}')
+        lines.append("# TYPE inflow_job_last_run_timestamp_seconds gauge")
+        for run_job, stamp in sorted(last_run.items()):
+            lines.append(f'inflow_job_last_run_timestamp_seconds{{job="{run_job}"}} {stamp:.0f}')
+        with open(path + '.tmp', 'w') as f:
+            f.write('\n'.join(lines) + '\n')
+        os.replace(path + '.tmp', path)
+
+    def export(self, job):
+        """write the metrics of the job run to the json log and the prometheus textfile, then reset them"""
+        self.write_json(job)
+        self.write_prometheus(job)
+        self.reset()
+
+
+def _read_runs(path):
+    """stage metrics and last run time of the jobs already in the textfile"""
+    runs, last_run = {}, {}
+    if not os.path.exists(path):
+        return runs, last_run
+    with open(path) as f:
+        for line in f:
+            if line.startswith('#') or '{' not in line:
+                continue
+            metric, value = line.rsplit(' ', 1)
+            name, labels = metric.split('{', 1)
+            labels = dict(item.split('=', 1) for item in labels.rstrip('}').split(','))
+            job = labels['job'].strip('"')
+            if name == 'inflow_job_last_run_timestamp_seconds':
+                last_run[job] = float(value)
+            elif name.startswith('inflow_stage_'):
+                stage_name = labels['stage'].strip('"')
+                totals = runs.setdefault(job, {}).setdefault(stage_name, dict.fromkeys(fields, 0))
+                totals[name[len('inflow_stage_'):]] = float(value)
+    return runs, last_run
+
+
+# metrics of the process
+metrics = Metrics()
+stage = metrics.stage
+timed = metrics.timed
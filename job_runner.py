@@ -0,0 +1,81 @@
+"""
+this module runs the scheduled jobs of main.py:
+JobGuard skips a run while the previous run of the same job is still going, and makes the jobs wait for each other
+(the return update uses the portfolios written by the rebalancing);
+run_parallel runs the per-strategy work of a run on a bounded thread pool, failures are printed with their traceback
+and raised once the other strategies are done, instead of being dropped
+"""
+import threading
+import traceback
+from functools import wraps
+from concurrent.futures import ThreadPoolExecutor
+from inflow_factor_class import print_with_time
+from instrumentation import metrics
+
+
+class JobGuard:
+    """
+    timeout: seconds a job waits for another running job before its run is skipped
+    """
+
+    def __init__(self, timeout=2 * 3600):
+        self.timeout = timeout
+        self.shared = threading.Lock()
+        self.lock = threading.Lock()
+        self.running = {}
+
+    def _job_lock(self, name):
+        with self.lock:
+            return self.running.setdefault(name, threading.Lock())
+
+    def run(self, name, func, *args, **kwargs):
+        """run func unless job `name` is already running, returns its result (None if the run is skipped)"""
+        job = self._job_lock(name)
+        if not job.acquire(blocking=False):
+            print_with_time(f"Job [{name}] is still running, this run is skipped.")
+            return None
+        try:
+            if not self.shared.acquire(timeout=self.timeout):
+                print_with_time(f"Job [{name}] waited {self.timeout}s for another job, this run is skipped.")
+                return None
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self.shared.release()
+        finally:
+            job.release()
+
+    def exclusive(self, name):
+        """decorator running the function through the guard as job `name`"""
+        def decorator(func):
+            @wraps(func)
+            def wrapper(*args, **kwargs):
+                return self.run(name, func, *args, **kwargs)
+            return wrapper
+        return decorator
+
+
+def run_parallel(func, items, workers=3, name="task"):
+    """
+    call func(item) for every item on at most `workers` threads, returns the results in the order of items;
+    every failure is printed with its traceback, the first one is raised after all items are done
+    """
+    items = list(items)
+    if not items:
+        return []
+    # queries of the workers are counted in the stages open here
+    func = metrics.carry(func)
+    with ThreadPoolExecutor(max_workers=max(1, min(workers, len(items)))) as pool:
+        futures = [pool.submit(func, item) for item in items]
+    results, errors = [], []
+    for item, future in zip(items, futures):
+        error = future.exception()
+        if error is None:
+            results.append(future.result())
+        else:
+            print_with_time(f"{name} [{item}] failed:\n"
+                            f"{''.join(traceback.format_exception(type(error), error, error.__traceback__))}")
+            errors.append(error)
+    if errors:
+        raise errors[0]
+    return results
@@ -0,0 +1,129 @@
+"""
+this module defines an index of the listing interval (first and last record in ChangeHoldAmountSM) of every stock;
+it answers the questions of the group-by queries that looked for newly listed stocks (query_ban in get_factor_data
+and the ban list of the analysis scripts) with searchsorted lookups on sorted arrays,
+the index is stored on disk and refreshed with the records of the new trading days only
+"""
+import os
+import threading
+import numpy as np
+import pandas as pd
+
+default_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'listing_index.npz')
+
+query_listing = """
+select InnerCode, min(Date) as first_date, max(Date) as last_date from AlternativeData.ChangeHoldAmountSM
+where date > %s group by InnerCode
+"""
+
+query_listing_dates = """
+select distinct Date as date from AlternativeData.ChangeHoldAmountSM where date > %s
+"""
+
+
+class ListingIndex:
+    """
+    dates: sorted trading days (datetime64[D]),
+    codes: sorted InnerCode (int64),
+    first, last: positions in dates of the first and last record of each stock
+    """
+
+    def __init__(self, path=default_path):
+        self.path = path
+        self.dates = np.array([], dtype='datetime64[D]')
+        self.codes = np.array([], dtype=np.int64)
+        self.first = np.array([], dtype=np.int64)
+        self.last = np.array([], dtype=np.int64)
+
+    @classmethod
+    def from_panel(cls, store, path=default_path):
+        """build the index from a loaded InflowPanelStore (same calendar as its trading_days)"""
+        index = cls(path)
+        count = np.asarray(store.cum_count)
+        has_record = count[-1] > 0
+        index.dates = store.dates
+        index.codes = store.codes[has_record]
+        # prefix counts are non-decreasing: rows below the total count end at the last record
+        index.first = store.first_record()[has_record]
+        index.last = (count < count[-1]).sum(axis=0)[has_record] - 1
+        return index
+
+    def exists(self):
+        return os.path.exists(self.path)
+
+    def load(self):
+        with np.load(self.path) as f:
+            self.dates, self.codes = f['dates'], f['codes']
+            self.first, self.last = f['first'], f['last']
+        return self
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        # temporary file of this thread, so concurrent saves never replace the file with a partial one
+        tmp = f"{self.path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp, 'wb') as f:
+            np.savez(f, dates=self.dates, codes=self.codes, first=self.first, last=self.last)
+        os.replace(tmp, self.path)
+
+    def update(self, con, overlap=5):
+        """
+        add the trading days and records after the last stored days (all of them if the index is not stored yet),
+        con is any connection accepted by pd.read_sql
+        """
+        if self.exists():
+            self.load()
+        keep = max(len(self.dates) - overlap, 0)
+        since = str(self.dates[keep - 1]) if keep > 0 else '1900-01-01'
+        new_dates = pd.to_datetime(pd.read_sql(query_listing_dates, con, params=(since,))['date']).values
+        records = pd.read_sql(query_listing, con, params=(since,))
+
+        # stored intervals as dates, merged with the intervals of the new records
+        old = pd.DataFrame({'first_date': self.dates[self.first], 'last_date': self.dates[self.last]},
+                           index=self.codes)
+        new = pd.DataFrame({'first_date': pd.to_datetime(records['first_date']).values.astype('datetime64[D]'),
+                            'last_date': pd.to_datetime(records['last_date']).values.astype('datetime64[D]')},
+                           index=records['InnerCode'].astype(np.int64).values)
+        both = pd.concat([old, new])
+        merged = both.groupby(level=0).agg({'first_date': 'min', 'last_date': 'max'})
+
+        self.dates = np.union1d(self.dates[:keep], new_dates.astype('datetime64[D]'))
+        self.codes = merged.index.values.astype(np.int64)
+        self.first = np.searchsorted(self.dates, merged['first_date'].values.astype('datetime64[D]'))
+        self.last = np.searchsorted(self.dates, merged['last_date'].values.astype('datetime64[D]'))
+        self.save()
+        return self
+
+    def position(self, ref_date):
+        """position of the last trading day on or before ref_date (-1 if there is none)"""
+        return np.searchsorted(self.dates, np.datetime64(str(ref_date)[:10], 'D'), side='right') - 1
+
+    def banned(self, ref_date, days=60):
+        """
+        stocks whose first record is on or after the `days`-th last trading day up to ref_date (same as query_ban),
+        nothing is banned if there are fewer than `days` trading days up to ref_date
+        """
+        i = self.position(ref_date)
+        if i < days - 1:
+            return self.codes[:0]
+        return self.codes[self.first >= i - days + 1]
+
+    def eligible(self, ref_date, days=60):
+        """stocks already listed on ref_date that are not banned"""
+        i = self.position(ref_date)
+        if i < days - 1:
+            return self.codes[self.first <= i]
+        return self.codes[self.first < i - days + 1]
+
+    def ban_list(self, i, days=60):
+        """
+        stocks excluded on the i-th trading day by the analysis scripts (same as their former query_status filter):
+        stocks first recorded within `days` trading days before i and/or last recorded within `days` days after i;
+        stocks recorded over the whole calendar are never excluded
+        """
+        n = len(self.dates)
+        partial = (self.first > 0) | (self.last < n - 1)
+        if i <= days:
+            return self.codes[partial & (self.last <= i + days)]
+        if i >= n - days:
+            return self.codes[partial & (self.first >= i - days)]
+        return self.codes[partial & (self.last <= i + days) & (self.first >= i - days)]
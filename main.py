@@ -1,73 +1,227 @@
+import traceback
 import pandas as pd
 import numpy as np
-from inflow_factor_class import Selector, Manager
+from inflow_factor_class import Selector, Manager, MongoSink, factor_cache, read_mysql, get_calendar, print_with_time
+from manager_state import StateManager
+from return_backfill import backfill_returns
+from trading_calendar import TradingCalendar, rebalance_days
+from prefetch import prefetch
+from instrumentation import metrics, stage
+from job_runner import JobGuard, run_parallel
 from apscheduler.schedulers.background import BlockingScheduler
+from apscheduler.executors.pool import ThreadPoolExecutor as JobExecutor
 from apscheduler.triggers.interval import IntervalTrigger
 
+strategies = ['pure', 'neu', 'absneu']
 
-def select_stock(date):
-    """Find portfolio stocks for the three strategies (rebalancing), date should be Friday"""
+# scheduled jobs skip a run while their previous run is going, and wait for each other
+guard = JobGuard()
+
+query_first_portfolio = """select min(date) as date from AlternativeData.InflowFactor;"""
+query_last_portfolio = """select max(date) as date from AlternativeData.InflowFactor;"""
+query_last_return = """select max(date) as date from AlternativeData.InflowFactorReturn;"""
+
+
+def select_stock(date, sink=None, workers=3):
+    """
+    Find portfolio stocks for the three strategies (rebalancing), date should be Friday
+    the strategies are selected and uploaded on `workers` threads (sharing one fetch of the factor data),
+    mongo documents are uploaded at the end, or left in sink if given (e.g. when replaying many dates)
+    """
     print(f"Selecting portfolios for date: {date}")
-    for strategy in ['pure', 'neu', 'absneu']:
+    mongo = sink or MongoSink()
+
+    def select(strategy):
         print(f"-- strategy: {strategy}")
         strat_pos = Selector(strategy, date)
         strat_pos.upload_mysql()
-        if strategy == 'absneu':
-            strat_pos.upload_mongo(long=True, short=True)
-            strat_pos.upload_mongo(long=True, short=False)
+        return strat_pos
+
+    with stage("select_stock"):
+        try:
+            factor_cache.get(date)
+            selectors = dict(zip(strategies, run_parallel(select, strategies, workers, name="select strategy")))
+            selectors['absneu'].upload_mongo(long=True, short=True, sink=mongo)
+            selectors['absneu'].upload_mongo(long=True, short=False, sink=mongo)
+        finally:
+            if sink is None:
+                mongo.flush()
 
-    next_reb = pd.to_datetime(date) + np.timedelta64(14, "D")
-    next_reb = str(next_reb)[:10]
+    next_reb = str(TradingCalendar.next_rebalance(date))
     print(f"next rebalance date: {next_reb}")
     print("---------------------------------------")
 
 
-def compute_return(date):
+def select_stocks(dates, sink=None, depth=2):
+    """
+    rebalance on each of the dates in order (e.g. when replaying many dates),
+    factor data of the next `depth` dates is fetched in the background while the current date is processed
+    (depth should stay below the size of factor_cache)
+    """
+    for date, _ in prefetch(dates, factor_cache.get, depth=depth):
+        select_stock(date, sink)
+
+
+def compute_return(date, sink=None, validate=False, workers=3):
+    """
+    compute returns of the three strategies on the date (all strategies are computed together by StateManager,
+    from the return states kept in data/manager_state, synced on `workers` threads; validate=True also checks them
+    against the database)
+    nothing is done if the date is a weekend day or a holiday of the calendar, ValueError is raised if the day has no
+    quotes yet (trading not closed: a weekday after the last day of the calendar, or no quotes of the held stocks)
+    mongo documents are uploaded at the end, or left in sink if given (e.g. when replaying many dates)
+    failures are printed with their traceback and raised
+    """
     print(f"Computing return for date: {date}")
-    for strategy in ['pure', 'neu', 'absneu']:
-        print(f"-- Strategy: {strategy}")
+    calendar = get_calendar(date)
+    if not calendar.is_trading_day(date):
+        # the calendar is refreshed up to date, a weekday after its last day has no quotes yet
+        if pd.Timestamp(date).weekday() < 5 and (not len(calendar.dates) or calendar.dates[-1] < np.datetime64(date)):
+            print_with_time(f"No quotes on {date} yet!")
+            raise ValueError
+        print_with_time("Not a trading day!")
+        return
+    mongo = sink or MongoSink()
+    with stage("compute_return"):
         try:
-            manager = Manager(strategy, date)
-            manager.upload_mysql()
-            if strategy == 'absneu':
-                manager.upload_mongo()
-                manager.upload_mongo(short=False)
-        except:
-            print("Update return failed.")
+            multi = StateManager(strategies, date, validate=validate, workers=workers)
+            multi.upload_mysql()
+            manager = multi.managers['absneu']
+            manager.upload_mongo(sink=mongo)
+            manager.upload_mongo(short=False, sink=mongo)
+        except Exception:
+            print_with_time(f"Update return failed for {date}:\n{traceback.format_exc()}")
+            raise
+        finally:
+            if sink is None:
+                mongo.flush()
     print("---------------------------------------")
 
 
+def compute_returns(dates, sink=None, workers=3):
+    """
+    compute returns of the trading days in dates (sorted): a single date is computed from the return states
+    (compute_return), several dates (e.g. missed while the host was down) are computed in one batched run from one
+    price matrix (backfill_returns, continuing from the returns stored before them) and their mongo documents
+    uploaded together;
+    the return states are rebuilt by the next compute_return
+    """
+    dates = list(dates)
+    if len(dates) <= 1:
+        for date in dates:
+            compute_return(date, sink, workers=workers)
+        return
+    print(f"Computing returns of {len(dates)} dates: {dates[0]} to {dates[-1]}")
+    mongo = sink or MongoSink()
+    with stage("compute_returns"):
+        try:
+            perf = backfill_returns(dates[0], dates[-1], strategies, upload=True, keep_stored=True)
+            for date, day in perf[perf['strategy'] == 'absneu'].groupby('date'):
+                manager = Manager('absneu', date, perf=day)
+                manager.upload_mongo(sink=mongo)
+                manager.upload_mongo(short=False, sink=mongo)
+        finally:
+            if sink is None:
+                mongo.flush()
+    print("---------------------------------------")
+
+
+def missed_return_dates(date):
+    """
+    trading days after the last date in InflowFactorReturn up to date; if the table is empty, the trading days after
+    the first rebalancing in InflowFactor (none if there are no portfolios yet);
+    days without quotes yet are not in the calendar, they are found by the next run since they have no returns stored
+    """
+    last = read_mysql(query_last_return).values[0, 0]
+    if last is None or pd.isnull(last):
+        last = read_mysql(query_first_portfolio).values[0, 0]
+        if last is None or pd.isnull(last):
+            return []
+    start = np.datetime64(pd.to_datetime(last).strftime("%Y-%m-%d")) + np.timedelta64(1, 'D')
+    return [str(d) for d in get_calendar(date).between(start, date)]
+
+
+def missed_rebalance_dates(date):
+    """
+    dates to rebalance on for the scheduled rebalancing fridays after the last portfolios in InflowFactor, up to the
+    friday of date's week; each is the monday of its week (yesterday of the tuesday run), the last one is date
+    (only date if InflowFactor is empty)
+    """
+    last = read_mysql(query_last_portfolio).values[0, 0]
+    if last is None or pd.isnull(last):
+        return [date]
+    day = np.datetime64(date)
+    friday = day + np.timedelta64(4 - pd.Timestamp(date).weekday(), 'D')
+    last = np.datetime64(pd.to_datetime(last).strftime("%Y-%m-%d"))
+    fridays = np.arange(last + np.timedelta64(rebalance_days, 'D'), friday + np.timedelta64(1, 'D'),
+                        np.timedelta64(rebalance_days, 'D'))
+    dates = [str(f - np.timedelta64(4, 'D')) for f in fridays]
+    if dates:
+        dates[-1] = date
+    return dates
+
+
+@guard.exclusive("inflow_rebalancing")
 def select_stock_yesterday():
+    """rebalance on yesterday, after the scheduled rebalances missed since the last stored portfolios"""
     date = pd.to_datetime('today').normalize() - np.timedelta64(1, "D")
     date = date.strftime("%Y-%m-%d")
-    select_stock(date)
+    try:
+        dates = missed_rebalance_dates(date)
+        if not dates:
+            print_with_time(f"Portfolios of the week of {date} are already stored.")
+        elif len(dates) == 1:
+            select_stock(dates[0])
+        else:
+            print_with_time(f"Catching up {len(dates)} rebalances: {dates}")
+            with MongoSink() as sink:
+                select_stocks(dates, sink)
+    finally:
+        # write the stage metrics of the run to logs/metrics.jsonl and logs/inflow_factor.prom
+        metrics.export("select_stock")
 
 
+@guard.exclusive("inflow_return_update")
 def compute_return_yesterday():
+    """compute returns of yesterday, together with the trading days missed since the last stored returns"""
     date = pd.to_datetime('today').normalize() - np.timedelta64(1, "D")
     date = date.strftime("%Y-%m-%d")
-    compute_return(date)
+    dates = missed_return_dates(date)
+    if not dates:
+        print_with_time(f"No trading day to update up to {date}.")
+    try:
+        compute_returns(dates)
+    finally:
+        metrics.export("compute_return")
 
 
 if __name__ == "__main__":
-    # dates = pd.date_range(start='2022-03-04', end='2022-07-05', freq='W-FRI')
-    # for date in dates[::2]:
-    #     date = str(date)[:10]
-    #     select_stock(date)
+    # with MongoSink() as sink:
+    #     dates = pd.date_range(start='2022-03-04', end='2022-07-05', freq='W-FRI')
+    #     select_stocks([str(date)[:10] for date in dates[::2]], sink)
+    #
+    #     dates = pd.date_range(start='2022-03-07', end='2022-07-05', freq='B')
+    #     for date in dates:
+    #         date = str(date)[:10]
+    #         compute_return(date, sink)
     #
-    # dates = pd.date_range(start='2022-03-07', end='2022-07-05', freq='B')
-    # for date in dates:
-    #     date = str(date)[:10]
-    #     compute_return(date)
+    # # or rebuild the whole return history in one pass (no mongo upload)
+    # backfill_returns('2022-03-07', '2022-07-05', upload=True)
 
     # compute_return_yesterday()
-    scheduler = BlockingScheduler()
+    # jobs run on their own threads (a long rebalancing does not delay the scheduler), a job that fired late runs
+    # once, and the dates missed while the host was down are caught up by the first run (also done at start)
+    scheduler = BlockingScheduler(executors={'default': JobExecutor(2)},
+                                  job_defaults={'coalesce': True, 'max_instances': 1, 'misfire_grace_time': 12 * 3600})
     intervalTrigger1 = IntervalTrigger(weeks=2, start_date='2022-07-05 06:00:00')
     intervalTrigger2 = IntervalTrigger(days=1, start_date='2022-07-05 07:00:00')
     scheduler.add_job(select_stock_yesterday, intervalTrigger1, timezone='Asia/Shanghai', id="inflow_rebalancing")
     scheduler.add_job(compute_return_yesterday, intervalTrigger2, timezone='Asia/Shanghai', id="inflow_return_update")
 
     try:
+        print("Catching up missed runs...")
+        select_stock_yesterday()
+        compute_return_yesterday()
         print("Scheduler starts...")
         scheduler.start()
     except (KeyboardInterrupt, SystemExit):
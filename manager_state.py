@@ -0,0 +1,212 @@
+"""
+this module keeps the state of the daily return computation of each strategy on disk:
+positions of the last rebalancing with their entry prices, discount ratios, and the cumulative values stored on the
+last calculation date and on the rebalancing date;
+the state is rebuilt from the database at each rebalancing and whenever its last date is not the previous trading day
+(missing state, skipped days, replays), so a daily run only looks up the last rebalancing date and fetches the close
+prices of the held codes,
+instead of reading the history of InflowFactorReturn and the turnover of two rebalances every day
+"""
+import os
+import numpy as np
+import pandas as pd
+from inflow_factor_class import Manager, read_mysql, upload_return, print_with_time, get_calendar
+from session import get_session
+from instrumentation import timed
+from job_runner import run_parallel
+
+default_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'manager_state')
+
+query_last_reb = """select max(date) as date from AlternativeData.InflowFactor where date < %s;"""
+
+query_entry = """
+select s.recommendation, s.code, q.closePrice as start_price from
+(select code, recommendation from InflowFactor where strategy = %s and date = %s) s
+inner join (select InnerCode, closePrice from jydb.QT_HKBefRehDQuote where tradingday = %s) q on s.code = q.InnerCode;
+"""
+
+query_quotes = """
+select InnerCode as code, closePrice as end_price from jydb.QT_HKBefRehDQuote where tradingday = %s and InnerCode in ({c});
+"""
+
+# cumulative values are stored in InflowFactorReturn with 4 decimals
+decimals = 4
+
+
+def _date(value):
+    return None if value is None or pd.isnull(value) else pd.to_datetime(value).strftime("%Y-%m-%d")
+
+
+class ManagerState:
+    """
+    state of one strategy:
+    reb_date: rebalancing date of the held positions, positions: recommendation, code, start_price (close on reb_date),
+    discount: discount ratios of the rebalancing (Manager.cal_discount),
+    last_date: last date with stored values, last_value / initial_value: side -> cumulative value stored on last_date /
+    on reb_date (sides without a value start from 1)
+    """
+    fields = ('reb_date', 'positions', 'discount', 'last_date', 'last_value', 'initial_value')
+
+    def __init__(self, strategy, path=default_path):
+        self.strategy = strategy
+        self.path = path
+        self.reb_date = None
+        self.positions = pd.DataFrame(columns=['recommendation', 'code', 'start_price'])
+        self.discount = pd.DataFrame(columns=['recommendation', 'd'])
+        self.last_date = None
+        self.last_value = {}
+        self.initial_value = {}
+
+    def _file(self):
+        return os.path.join(self.path, f"{self.strategy}.pkl")
+
+    def exists(self):
+        return os.path.exists(self._file())
+
+    def load(self):
+        state = pd.read_pickle(self._file())
+        for field in self.fields:
+            setattr(self, field, state[field])
+        return self
+
+    def save(self):
+        os.makedirs(self.path, exist_ok=True)
+        pd.to_pickle({field: getattr(self, field) for field in self.fields}, self._file() + '.tmp')
+        os.replace(self._file() + '.tmp', self._file())
+
+    def _manager(self, cal_date, session):
+        """Manager of the rebalancing without computed returns, used for its database queries"""
+        return Manager(self.strategy, cal_date, session=session, perf=pd.DataFrame(), last_reb_date=self.reb_date)
+
+    @timed("ManagerState.rebuild")
+    def rebuild(self, reb_date, cal_date, session=None):
+        """
+        rebuild the state for cal_date from the database (same queries as Manager): positions, entry prices and
+        discount ratios of the rebalancing on reb_date, and the previous cumulative values
+        """
+        session = session or get_session()
+        self.reb_date = reb_date
+        self.positions = read_mysql(query_entry, self.strategy, reb_date, reb_date, session=session)
+        self.discount = self._manager(cal_date, session).cal_discount()
+        pre = self._manager(cal_date, session).get_history()
+        if pre.empty:
+            self.last_date, self.last_value, self.initial_value = None, {}, {}
+        else:
+            self.last_date = _date(pre['date'].iloc[0])
+            self.last_value = dict(zip(pre['recommendation'], pre['last_value']))
+            self.initial_value = dict(zip(pre['recommendation'], pre['initial_value']))
+        print_with_time(f"Rebuilt return state of [{self.strategy}] for {cal_date} (rebalancing {reb_date})")
+
+    def sync(self, reb_date, cal_date, prev_date, session=None):
+        """
+        bring the state to cal_date: nothing to do if it holds the rebalancing reb_date and the values of the previous
+        trading day prev_date, otherwise it is rebuilt from the database (new rebalancing, missing state, skipped days,
+        or a state moved by a replay of other dates)
+        """
+        if self.reb_date != reb_date or self.last_date != prev_date:
+            self.rebuild(reb_date, cal_date, session)
+
+    def history(self):
+        """previous cumulative values as returned by Manager.get_history"""
+        if self.last_date is None:
+            return pd.DataFrame(columns=['date', 'strategy', 'recommendation', 'last_value', 'initial_value'])
+        sides = list(self.last_value)
+        return pd.DataFrame({'date': self.last_date, 'strategy': self.strategy, 'recommendation': sides,
+                             'last_value': [self.last_value[s] for s in sides],
+                             'initial_value': [self.initial_value.get(s, 1) for s in sides]})
+
+    def cal_return(self, cal_date, quotes, session=None):
+        """returns on cal_date (same as Manager.cal_return) from the close prices of the held codes (code, end_price)"""
+        perf = pd.merge(self.positions, quotes, on='code')
+        perf = perf.dropna(subset=['start_price', 'end_price'])
+        # raise exception if no data is returned, i.e. the calculation date is not trading day
+        if perf.empty:
+            print_with_time("Not a trading day!")
+            raise ValueError
+        perf['gross_ret'] = perf['end_price'] / perf['start_price']
+        return self._manager(cal_date, session).combine(perf, self.history(), self.discount)
+
+    def commit(self, cal_date, perf):
+        """record the values of cal_date (after they are uploaded) and save the state"""
+        self.last_date = cal_date
+        self.last_value = dict(zip(perf['recommendation'], perf['cumulative_value'].round(decimals)))
+        self.save()
+
+
+class StateManager:
+    """
+    this class computes returns of several strategies at the calculation date from their persisted states,
+    with the same results as MultiManager; after the first run of a rebalancing period a day needs two queries:
+    the last rebalancing date and the close prices of the held codes
+    validate: also compute the returns from the database with Manager, report the differences and rebuild the
+    states that do not match
+    workers: number of threads syncing the states of the strategies (rebuilds run their queries concurrently)
+    """
+
+    def __init__(self, strategies, date, session=None, validate=False, path=default_path, workers=3):
+        self.strategies = list(strategies)
+        self.session = session or get_session()
+        self.cal_date = date  # string format "%Y-%m-%d"
+        path = self.session.store_path(path)
+        self.states = {s: ManagerState(s, path) for s in self.strategies}
+        for state in self.states.values():
+            if state.exists():
+                state.load()
+
+        self.last_reb_date = _date(read_mysql(query_last_reb, date, session=self.session).values[0, 0])
+        prev_date = str(get_calendar(date, self.session).previous(np.datetime64(date) - np.timedelta64(1, 'D')))
+        run_parallel(lambda s: self.states[s].sync(self.last_reb_date, date, prev_date, self.session),
+                     self.strategies, workers, name="sync return state of")
+        self.perf = self.cal_return()
+        self.mismatch = self.validate() if validate else []
+
+        # one manager per strategy for uploading
+        self.managers = {s: Manager(s, date, session=self.session, perf=self.perf[self.perf.strategy == s].copy(),
+                                    last_reb_date=self.last_reb_date) for s in self.strategies}
+
+    @timed("StateManager.cal_return")
+    def cal_return(self):
+        codes = sorted({int(c) for state in self.states.values() for c in state.positions['code']})
+        if codes:
+            quotes = read_mysql(query_quotes.format(c=','.join(['%s'] * len(codes))), self.cal_date, *codes,
+                                session=self.session)
+        else:
+            quotes = pd.DataFrame(columns=['code', 'end_price'])
+        return pd.concat([self.states[s].cal_return(self.cal_date, quotes, self.session) for s in self.strategies],
+                         ignore_index=True)
+
+    def validate(self, tol=1e-8):
+        """
+        reconcile the returns computed from the states with Manager (history and turnover read from the database),
+        states of strategies that differ are rebuilt and their returns replaced; returns the mismatched strategies
+        """
+        cols = ['raw_ret', 'd', 'last_value', 'initial_value', 'cumulative_value', 'daily_ret']
+        mismatch = []
+        for s in self.strategies:
+            expected = Manager(s, self.cal_date, session=self.session).perf.set_index('recommendation')[cols]
+            got = self.perf[self.perf.strategy == s].set_index('recommendation')[cols]
+            if set(got.index) != set(expected.index) or not np.allclose(
+                    got.reindex(expected.index).astype(float), expected.astype(float), rtol=0, atol=tol, equal_nan=True):
+                print_with_time(f"Return state of [{s}] does not match the database:\n{got}\n{expected}")
+                mismatch.append(s)
+                self.states[s].rebuild(self.last_reb_date, self.cal_date, self.session)
+        if mismatch:
+            self.perf = self.cal_return()
+        else:
+            print_with_time(f"Return states of {self.strategies} match the database.")
+        return mismatch
+
+    def upload_mysql(self):
+        """
+        upload returns of all strategies in InflowFactorReturn table, then save the states of the strategies whose
+        rows were all stored (the other states are not moved, they are rebuilt from the database by the next run);
+        returns the strategies with failed rows
+        """
+        failed = upload_return(self.perf, session=self.session)
+        failed = sorted(set(self.perf.loc[[i for i, _ in failed], 'strategy']))
+        for s, state in self.states.items():
+            if s in failed:
+                print_with_time(f"Returns of [{s}] on {self.cal_date} were not all stored, its state is not saved.")
+                continue
+            state.commit(self.cal_date, self.perf[self.perf.strategy == s])
+        return failed
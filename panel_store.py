@@ -0,0 +1,180 @@
+"""
+this module defines a local panel store of the southbound inflow data (AlternativeData.ChangeHoldAmountSM)
+the store keeps a (trading day x stock) matrix of change_amount as numpy files on disk;
+it is bulk-built once, appended incrementally, and sliced in memory by the analysis scripts
+instead of aggregating the table with one sql query per trading day;
+prefix sums over trading days are stored next to the matrix, so the inflow sum of any window is the difference
+of two rows (constant time per stock whatever the window length)
+"""
+import os
+import threading
+import numpy as np
+import pandas as pd
+
+default_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'inflow_panel')
+
+query_inflow = """
+select Date as date, InnerCode, sum(change_amount) as change_amount from AlternativeData.ChangeHoldAmountSM
+where date > %s group by Date, InnerCode
+"""
+
+
+class InflowPanelStore:
+    """
+    panel of daily change_amount:
+    dates: sorted trading days (datetime64[D]),
+    codes: sorted InnerCode (int64),
+    values: float64 matrix of shape (len(dates), len(codes)), nan if the stock has no record on the day,
+    cum_amount / cum_count: prefix sums of shape (len(dates) + 1, len(codes)), row t holds the inflow sum / the number
+    of records of the first t trading days
+    """
+    files = ('dates', 'codes', 'change_amount')
+    index_files = ('cum_amount', 'cum_count')
+
+    def __init__(self, path=default_path):
+        self.path = path
+        self.dates = np.array([], dtype='datetime64[D]')
+        self.codes = np.array([], dtype=np.int64)
+        self.values = np.empty((0, 0))
+        self.cum_amount = np.zeros((1, 0))
+        self.cum_count = np.zeros((1, 0), dtype=np.int64)
+
+    def _file(self, name):
+        return os.path.join(self.path, f"{name}.npy")
+
+    def exists(self):
+        return all(os.path.exists(self._file(name)) for name in self.files)
+
+    def load(self, mmap=True):
+        """load the panel from disk, the value matrix is memory-mapped (read-only) unless mmap is False"""
+        self.dates = np.load(self._file('dates'))
+        self.codes = np.load(self._file('codes'))
+        self.values = np.load(self._file('change_amount'), mmap_mode='r' if mmap else None)
+        if all(os.path.exists(self._file(name)) for name in self.index_files):
+            self.cum_amount = np.load(self._file('cum_amount'), mmap_mode='r' if mmap else None)
+            self.cum_count = np.load(self._file('cum_count'), mmap_mode='r' if mmap else None)
+        else:
+            # panel stored before the prefix sums were added
+            self._build_prefix()
+        return self
+
+    def save(self):
+        """write the panel to disk, each file is replaced only after it is completely written"""
+        os.makedirs(self.path, exist_ok=True)
+        arrays = (self.dates, self.codes, self.values, self.cum_amount, self.cum_count)
+        for name, array in zip(self.files + self.index_files, arrays):
+            # temporary file of this thread, so concurrent saves never replace a file with a partial one
+            tmp = f"{self._file(name)}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp, 'wb') as f:
+                np.save(f, np.ascontiguousarray(array))
+            os.replace(tmp, self._file(name))
+
+    def build(self, con, start_date='1900-01-01'):
+        """bulk-build the panel from all records after start_date, con is any connection accepted by pd.read_sql"""
+        records = pd.read_sql(query_inflow, con, params=(start_date,))
+        self._set_frame(self._pivot(records))
+        self.save()
+        return self
+
+    def update(self, con, overlap=5):
+        """
+        append new trading days to the panel;
+        the last `overlap` stored days are fetched again in case they were incomplete when last stored
+        """
+        if not self.exists():
+            return self.build(con)
+        self.load(mmap=False)
+        keep = max(len(self.dates) - overlap, 0)
+        since = str(self.dates[keep - 1]) if keep > 0 else '1900-01-01'
+        records = pd.read_sql(query_inflow, con, params=(since,))
+
+        old = pd.DataFrame(self.values[:keep], index=pd.DatetimeIndex(self.dates[:keep]), columns=self.codes)
+        prefix = (self.codes, self.cum_amount[:keep + 1], self.cum_count[:keep + 1])
+        self._set_frame(pd.concat([old, self._pivot(records)]), prefix)
+        self.save()
+        return self
+
+    @staticmethod
+    def _pivot(records):
+        records['date'] = pd.to_datetime(records['date'])
+        records['InnerCode'] = records['InnerCode'].astype(np.int64)
+        records['change_amount'] = records['change_amount'].astype(float)
+        return records.pivot_table(index='date', columns='InnerCode', values='change_amount', aggfunc='sum')
+
+    def _set_frame(self, frame, prefix=None):
+        frame = frame.sort_index().sort_index(axis=1)
+        self.dates = frame.index.values.astype('datetime64[D]')
+        self.codes = frame.columns.values.astype(np.int64)
+        self.values = frame.values.astype(np.float64)
+        self._build_prefix(prefix)
+
+    def _build_prefix(self, prefix=None):
+        """
+        compute the prefix sums, prefix = (codes, cum_amount, cum_count) of the first rows if they are already known
+        (only the rows of the new trading days are accumulated then)
+        """
+        cum_amount = np.zeros((len(self.dates) + 1, len(self.codes)))
+        cum_count = np.zeros((len(self.dates) + 1, len(self.codes)), dtype=np.int64)
+        start = 0
+        if prefix is not None:
+            # stocks that were not in the panel before have no records in the first rows
+            codes, amount, count = prefix
+            col = np.searchsorted(self.codes, codes)
+            start = len(amount) - 1
+            cum_amount[:start + 1, col] = amount
+            cum_count[:start + 1, col] = count
+        block = self.values[start:]
+        cum_amount[start + 1:] = cum_amount[start] + np.cumsum(np.nan_to_num(block), axis=0)
+        cum_count[start + 1:] = cum_count[start] + np.cumsum(~np.isnan(block), axis=0)
+        self.cum_amount, self.cum_count = cum_amount, cum_count
+
+    def date_range(self, start_date, end_date):
+        """positions [i, j) of the stored trading days between start_date and end_date (both inclusive)"""
+        i = np.searchsorted(self.dates, np.datetime64(str(start_date)[:10], 'D'), side='left')
+        j = np.searchsorted(self.dates, np.datetime64(str(end_date)[:10], 'D'), side='right')
+        return i, j
+
+    def window_sums(self, i, j):
+        """
+        inflow sum and number of records of every stock over the trading days [i, j),
+        i and j are positions (from date_range) or arrays of positions for several windows at once
+        """
+        return self.cum_amount[j] - self.cum_amount[i], self.cum_count[j] - self.cum_count[i]
+
+    def first_record(self):
+        """position of the first record of each stock (len(dates) if it has none)"""
+        # prefix counts are non-decreasing: the number of leading zero rows is the first record position
+        return (np.asarray(self.cum_count[1:]) == 0).sum(axis=0)
+
+    def listed(self, j, days=60):
+        """
+        mask of stocks that are not newly listed at position j: their first record is more than `days` trading
+        days before j (no stock is excluded when there are fewer than `days` days before j), as query_ban
+        """
+        j = np.asarray(j)
+        first = self.first_record()
+        return ~((j[..., None] >= days) & (first >= (j - days)[..., None]))
+
+    def window(self, start_date, end_date, exclude=None):
+        """
+        aggregate inflow of every stock between start_date and end_date (both inclusive),
+        equivalent to `select InnerCode, sum(change_amount) as delta, avg(change_amount) as avg ... group by InnerCode`;
+        stocks without any record in the window are dropped, codes in exclude are removed
+        """
+        i, j = self.date_range(start_date, end_date)
+        total, cnt = self.window_sums(i, j)
+        has_record = cnt > 0
+        df = pd.DataFrame({'InnerCode': self.codes[has_record],
+                           'delta': total[has_record],
+                           'avg': total[has_record] / cnt[has_record]})
+        if exclude is not None:
+            df = df[~df.InnerCode.isin(np.asarray(exclude, dtype=np.int64))]
+        return df.reset_index(drop=True)
+
+    def trading_days(self):
+        """
+        trading days in the panel with the number of stocks traded by mainland investors,
+        same output as counting the records with change_amount <> 0 of each date in ChangeHoldAmountSM
+        """
+        traded = np.nan_to_num(np.asarray(self.values)) != 0
+        return pd.DataFrame({'date': pd.DatetimeIndex(self.dates), 'total': traded.sum(axis=1)})
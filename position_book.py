@@ -0,0 +1,85 @@
+"""
+this module defines a compact book of positions: sorted int32 stock codes with a float64 amount for each;
+the stay / remove / new comparisons of two rebalances are searchsorted lookups on the sorted codes,
+instead of building small dataframes and joining them with isin at every rebalance;
+it is used by Manager.cal_discount and by the capital recursion of backtest_engine
+"""
+import numpy as np
+
+
+def _member(codes, sorted_codes):
+    """mask of the codes found in sorted_codes"""
+    if len(sorted_codes) == 0:
+        return np.zeros(len(codes), dtype=bool)
+    pos = np.searchsorted(sorted_codes, codes)
+    pos[pos == len(sorted_codes)] = 0
+    return sorted_codes[pos] == codes
+
+
+class PositionBook:
+    """
+    codes: sorted stock codes (int32), amounts: amount held in each stock (float64)
+    """
+    __slots__ = ('codes', 'amounts')
+
+    def __init__(self, codes=(), amounts=None, is_sorted=False):
+        codes = np.asarray(codes, dtype=np.int32)
+        amounts = np.zeros(len(codes)) if amounts is None else np.asarray(amounts, dtype=np.float64)
+        if len(codes) != len(amounts):
+            raise ValueError("codes and amounts must have the same length")
+        if not is_sorted:
+            order = np.argsort(codes, kind='stable')
+            codes, amounts = codes[order], amounts[order]
+        self.codes = codes
+        self.amounts = amounts
+
+    @classmethod
+    def equal(cls, codes, amount, is_sorted=False):
+        """book holding the same amount of every stock in codes"""
+        codes = np.asarray(codes, dtype=np.int32)
+        return cls(codes, np.full(len(codes), amount, dtype=np.float64), is_sorted)
+
+    def __len__(self):
+        return len(self.codes)
+
+    def __repr__(self):
+        return f"PositionBook({len(self)} positions, total {self.total():.6g})"
+
+    def total(self):
+        """sum of the amounts (nan amounts are left out)"""
+        return np.nansum(self.amounts)
+
+    def weights(self):
+        """amounts as fractions of the total"""
+        return self.amounts / self.total()
+
+    def grow(self, growth):
+        """book after every amount is multiplied by its growth (1 + return, aligned with codes)"""
+        return PositionBook(self.codes, self.amounts * growth, is_sorted=True)
+
+    def isin(self, other):
+        """mask of the positions whose code is also held by other (a PositionBook or sorted codes)"""
+        return _member(self.codes, other.codes if isinstance(other, PositionBook) else np.asarray(other))
+
+    def stay(self, other):
+        """positions also held by other, with the amounts of this book"""
+        held = self.isin(other)
+        return PositionBook(self.codes[held], self.amounts[held], is_sorted=True)
+
+    def removed(self, other):
+        """positions not held by other any more"""
+        held = self.isin(other)
+        return PositionBook(self.codes[~held], self.amounts[~held], is_sorted=True)
+
+    def added(self, other):
+        """positions of other that are not held by this book"""
+        return other.removed(self)
+
+    def diff(self, other):
+        """
+        comparison with the next book other: mask of the positions that stay (over this book),
+        number of positions removed and number of positions added
+        """
+        held = self.isin(other)
+        n_stay = int(held.sum())
+        return held, len(self) - n_stay, len(other) - n_stay
@@ -0,0 +1,36 @@
+"""
+this module defines a prefetching pipeline for loops that fetch data of one date and then process it:
+fetches run in background threads and the data of the next dates is loaded while the current date is processed,
+the number of dates fetched ahead and the number of concurrent fetches (connections) are bounded
+"""
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from instrumentation import metrics
+
+
+def prefetch(items, fetch, depth=2, workers=1):
+    """
+    yield (item, fetch(item)) in the order of items
+    depth: number of items fetched ahead of the one processed by the caller,
+    workers: number of fetches running at the same time (keep 1 when fetch uses a single dbapi connection,
+    use more only with a connection pool such as session.engine)
+    an exception raised by fetch is raised when its item is reached
+    """
+    items = iter(items)
+    # queries of the fetches are counted in the stages open when the loop starts
+    fetch = metrics.carry(fetch)
+    pending = deque()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        try:
+            for item in items:
+                pending.append((item, pool.submit(fetch, item)))
+                if len(pending) > depth:
+                    item, future = pending.popleft()
+                    yield item, future.result()
+            while pending:
+                item, future = pending.popleft()
+                yield item, future.result()
+        finally:
+            # the caller stopped early or a fetch failed: do not start the remaining fetches
+            for _, future in pending:
+                future.cancel()
@@ -0,0 +1,213 @@
+"""
+this module defines an opt-in read-through disk cache for query results (read_mysql and pd.read_sql):
+results are stored as pickle files keyed by a hash of the sql text and the parameters,
+queries on dates that are settled (all date parameters older than settle_days) never expire, the others (and all
+queries on tables backfilled late, ChangeHoldAmountSM) expire after recent_ttl seconds,
+and the least recently used files are evicted above max_bytes;
+queries on the tables written by the project (InflowFactor, InflowFactorReturn) are never cached
+"""
+import os
+import re
+import json
+import time
+import hashlib
+import datetime
+import threading
+import numpy as np
+import pandas as pd
+
+default_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'query_cache')
+
+_date = re.compile(r'^\d{4}-\d{2}-\d{2}')
+
+
+def _param(value):
+    """parameter as text (dates in "%Y-%m-%d" whatever their type)"""
+    if isinstance(value, (np.datetime64, datetime.date)):
+        return pd.Timestamp(value).strftime("%Y-%m-%d")
+    if isinstance(value, np.generic):
+        value = value.item()
+    return str(value)
+
+
+class QueryCache:
+    """
+    path: folder of the result files and of index.json (key -> file size, expiry, last use and query),
+    max_bytes: total size of the files kept, least recently used files are removed beyond it,
+    settle_days: results of queries whose date parameters are all older than this many days never expire,
+    recent_ttl: seconds after which other results expire,
+    exclude: tables whose queries are always sent to the database,
+    late: tables whose past records can still be added (see check_complete_records), their results always expire
+    after recent_ttl seconds
+    """
+
+    def __init__(self, path=default_path, max_bytes=2 * 1024 ** 3, settle_days=7, recent_ttl=3600,
+                 exclude=('InflowFactor', 'InflowFactorReturn'), late=('ChangeHoldAmountSM',)):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.settle_days = settle_days
+        self.recent_ttl = recent_ttl
+        self.exclude = re.compile(r'\b(' + '|'.join(exclude) + r')\b', re.IGNORECASE) if exclude else None
+        self.late = re.compile(r'\b(' + '|'.join(late) + r')\b', re.IGNORECASE) if late else None
+        self.index = {}
+        self.lock = threading.Lock()
+        self.counts = dict.fromkeys(['hits', 'misses', 'bypassed', 'expired', 'evicted', 'bytes_read',
+                                     'bytes_written'], 0)
+        self._unsaved = 0
+        self.load()
+
+    def _file(self, key):
+        return os.path.join(self.path, f"{key}.pkl")
+
+    def load(self):
+        """read the index of the files stored by previous runs"""
+        file = os.path.join(self.path, 'index.json')
+        if os.path.exists(file):
+            with open(file) as f:
+                self.index = json.load(f)
+        return self
+
+    def save(self):
+        """write the index (last uses are otherwise written every 50 changes)"""
+        with self.lock:
+            self._save()
+
+    def _save(self):
+        os.makedirs(self.path, exist_ok=True)
+        file = os.path.join(self.path, 'index.json')
+        with open(file + '.tmp', 'w') as f:
+            json.dump(self.index, f)
+        os.replace(file + '.tmp', file)
+        self._unsaved = 0
+
+    def _touched(self):
+        self._unsaved += 1
+        if self._unsaved >= 50:
+            self._save()
+
+    @staticmethod
+    def key(query, params=()):
+        """hash of the sql text (whitespace collapsed) and the parameters"""
+        text = ' '.join(query.split()) + '\x00' + json.dumps([_param(p) for p in params])
+        return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+    def cacheable(self, query):
+        return self.exclude is None or not self.exclude.search(query)
+
+    def ttl(self, params=(), query=''):
+        """seconds before the result expires, None if every date parameter is settled (and no table is late)"""
+        if self.late is not None and self.late.search(query):
+            return self.recent_ttl
+        dates = [pd.Timestamp(_param(p)[:10]) for p in params if _date.match(_param(p))]
+        settled = pd.Timestamp('today').normalize() - pd.Timedelta(days=self.settle_days)
+        if dates and max(dates) < settled:
+            return None
+        return self.recent_ttl
+
+    def get(self, query, params=()):
+        """stored result of the query, None if it is not stored, expired or not cacheable"""
+        if not self.cacheable(query):
+            with self.lock:
+                self.counts['bypassed'] += 1
+            return None
+        key = self.key(query, params)
+        with self.lock:
+            entry = self.index.get(key)
+            if entry is not None and entry['expires'] is not None and entry['expires'] < time.time():
+                self._remove(key)
+                self.counts['expired'] += 1
+                entry = None
+            if entry is None or not os.path.exists(self._file(key)):
+                self.index.pop(key, None)
+                self.counts['misses'] += 1
+                return None
+            entry['used'] = time.time()
+            self.counts['hits'] += 1
+            self.counts['bytes_read'] += entry['bytes']
+            self._touched()
+        try:
+            return pd.read_pickle(self._file(key))
+        except FileNotFoundError:  # evicted by another thread in the meantime
+            return None
+
+    def put(self, query, params, data, ttl='auto'):
+        """store the result of the query, ttl: seconds, None (never expires) or 'auto' (see self.ttl)"""
+        if not self.cacheable(query):
+            return
+        key = self.key(query, params)
+        ttl = self.ttl(params, query) if ttl == 'auto' else ttl
+        os.makedirs(self.path, exist_ok=True)
+        file = self._file(key)
+        data.to_pickle(file + f'.{threading.get_ident()}.tmp')
+        os.replace(file + f'.{threading.get_ident()}.tmp', file)
+        now = time.time()
+        with self.lock:
+            self.index[key] = {'bytes': os.path.getsize(file), 'expires': None if ttl is None else now + ttl,
+                               'used': now, 'query': ' '.join(query.split())[:200]}
+            self.counts['bytes_written'] += self.index[key]['bytes']
+            self._evict()
+            self._save()
+
+    def read_sql(self, query, con, params=(), ttl='auto'):
+        """pd.read_sql(query, con, params) through the cache"""
+        params = tuple(params)
+        data = self.get(query, params)
+        if data is None:
+            data = pd.read_sql(query, con, params=params)
+            self.put(query, params, data, ttl)
+        return data
+
+    def _remove(self, key):
+        self.index.pop(key, None)
+        if os.path.exists(self._file(key)):
+            os.remove(self._file(key))
+
+    def _evict(self):
+        """remove the least recently used files until the total size is below max_bytes"""
+        total = sum(entry['bytes'] for entry in self.index.values())
+        for key in sorted(self.index, key=lambda k: self.index[k]['used']):
+            if total <= self.max_bytes:
+                break
+            total -= self.index[key]['bytes']
+            self._remove(key)
+            self.counts['evicted'] += 1
+
+    def invalidate(self, pattern=None):
+        """remove the stored results whose query contains pattern (all results if pattern is None)"""
+        with self.lock:
+            for key in [k for k, entry in self.index.items() if pattern is None or pattern in entry['query']]:
+                self._remove(key)
+            self._save()
+
+    def stats(self):
+        """hit / miss counts since the cache was created, with the number and size of stored results"""
+        with self.lock:
+            stats = dict(self.counts)
+            stats['entries'] = len(self.index)
+            stats['bytes'] = sum(entry['bytes'] for entry in self.index.values())
+        looked_up = stats['hits'] + stats['misses']
+        stats['hit_rate'] = stats['hits'] / looked_up if looked_up else None
+        return stats
+
+
+# cache used by read_mysql, None until enabled
+_cache = None
+
+
+def enable(cache=None, **options):
+    """route read_mysql through a query cache (QueryCache(**options) if cache is not given) and return it"""
+    global _cache
+    _cache = cache or QueryCache(**options)
+    return _cache
+
+
+def disable():
+    """stop caching read_mysql, the stored results stay on disk"""
+    global _cache
+    if _cache is not None:
+        _cache.save()
+    _cache = None
+
+
+def get_cache():
+    return _cache
@@ -0,0 +1,100 @@
+"""
+this module defines a ledger of the dates ingested by the two sources of the inflow data:
+hong kong stock connect holdings in jydb.LC_SHSZHSCHoldings and the derived AlternativeData.ChangeHoldAmountSM;
+the ledger is stored on disk and refreshed with the recent dates and the dates still missing in the last month only,
+so completeness of any date range is answered in memory together with the list of missing dates
+"""
+import os
+import threading
+import numpy as np
+import pandas as pd
+
+default_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'record_ledger.npz')
+
+# tradingtype = 5, infosource=72 stands for hong kong stock connect trading info
+query_sources = {
+    'jydb': """SELECT distinct EndDate as date FROM jydb.LC_SHSZHSCHoldings
+            where tradingtype=5 and infosource=72 and EndDate > %s and weekday(EndDate) <=4;""",
+    'inflow': "SELECT distinct Date as date FROM AlternativeData.ChangeHoldAmountSM where Date > %s;",
+}
+
+
+def _days(dates):
+    return pd.to_datetime(pd.Series(dates, dtype=object)).values.astype('datetime64[D]')
+
+
+class RecordLedger:
+    """dates: dict source -> sorted dates (datetime64[D]) with records in the source"""
+
+    def __init__(self, path=default_path):
+        self.path = path
+        self.dates = {source: np.array([], dtype='datetime64[D]') for source in query_sources}
+
+    def exists(self):
+        return os.path.exists(self.path)
+
+    def load(self):
+        with np.load(self.path) as f:
+            self.dates = {source: f[source] for source in query_sources}
+        return self
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        # temporary file of this thread, so concurrent saves never replace the file with a partial one
+        tmp = f"{self.path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp, 'wb') as f:
+            np.savez(f, **self.dates)
+        os.replace(tmp, self.path)
+
+    def since(self, overlap=5, gap_days=30):
+        """
+        date after which the sources are fetched again: the last `overlap` dates of jydb (records of recent days
+        may still be loading) and every date after the first missing one within the last `gap_days` days
+        (recent gaps filled by a backfill); older gaps are kept as they are, so a date that never gets records
+        does not make every update read the sources from that date on
+        """
+        jy = self.dates['jydb']
+        if not len(jy):
+            return np.datetime64('1900-01-01', 'D')
+        since = jy[max(len(jy) - overlap, 0)] - np.timedelta64(1, 'D')
+        gaps = self.missing(start_date=jy[-1] - np.timedelta64(gap_days, 'D'))
+        if len(gaps):
+            since = min(since, gaps[0] - np.timedelta64(1, 'D'))
+        return since
+
+    def update(self, con, overlap=5, gap_days=30):
+        """
+        refresh the dates of both sources after self.since(overlap, gap_days) (all dates if the ledger is not stored
+        yet), con is any connection accepted by pd.read_sql
+        """
+        if self.exists():
+            self.load()
+        since = self.since(overlap, gap_days)
+        for source, query in query_sources.items():
+            new = pd.read_sql(query, con, params=(str(since),))
+            kept = self.dates[source][self.dates[source] <= since]
+            self.dates[source] = np.union1d(kept, _days(new['date']))
+        self.save()
+        return self
+
+    def _between(self, source, start_date=None, end_date=None):
+        dates = self.dates[source]
+        i = 0 if start_date is None else np.searchsorted(dates, np.datetime64(str(start_date)[:10], 'D'), 'left')
+        j = len(dates) if end_date is None else \
+            np.searchsorted(dates, np.datetime64(str(end_date)[:10], 'D'), 'right')
+        return dates[i:j]
+
+    def counts(self, start_date=None, end_date=None):
+        """number of dates in ChangeHoldAmountSM and in jydb between start_date and end_date (both inclusive)"""
+        return len(self._between('inflow', start_date, end_date)), len(self._between('jydb', start_date, end_date))
+
+    def missing(self, start_date=None, end_date=None):
+        """dates with jydb holdings but without records in ChangeHoldAmountSM"""
+        return np.setdiff1d(self._between('jydb', start_date, end_date), self.dates['inflow'])
+
+    def extra(self, start_date=None, end_date=None):
+        """dates with records in ChangeHoldAmountSM but without jydb holdings"""
+        return np.setdiff1d(self._between('inflow', start_date, end_date), self.dates['jydb'])
+
+    def is_complete(self, start_date=None, end_date=None):
+        return not len(self.missing(start_date, end_date)) and not len(self.extra(start_date, end_date))
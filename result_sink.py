@@ -0,0 +1,73 @@
+"""
+this module defines a buffered sink for the per-date results of long analysis runs (e.g. correlation_test):
+results are kept in memory and appended to a checkpoint folder as one part file every `every` dates,
+nothing is rewritten during the run and an interrupted run resumes after its last checkpoint
+"""
+import os
+import glob
+import pandas as pd
+
+
+class ResultSink:
+    """
+    per-date result frames of one run
+    path: checkpoint folder (one part_*.pkl file per checkpoint), every: number of dates between two checkpoints
+    """
+
+    def __init__(self, path, every=50):
+        self.path = path
+        self.every = every
+        self.keys = set()
+        self.frames = []
+        self.pending = []
+        self.n_parts = 0
+        self.load()
+
+    def _parts(self):
+        return sorted(glob.glob(os.path.join(self.path, 'part_*.pkl')))
+
+    def load(self):
+        """read the results stored by previous checkpoints"""
+        for file in self._parts():
+            part = pd.read_pickle(file)
+            self.keys.update(part['keys'])
+            self.frames.append(part['frame'])
+            self.n_parts += 1
+        return self
+
+    def done(self, key):
+        """whether the results of key (e.g. a date) are already in the sink"""
+        return key in self.keys
+
+    def add(self, key, frame):
+        """add the results of key, a checkpoint is written every `every` keys"""
+        self.keys.add(key)
+        self.frames.append(frame)
+        self.pending.append((key, frame))
+        if len(self.pending) >= self.every:
+            self.checkpoint()
+
+    def checkpoint(self):
+        """append the results added since the last checkpoint as a new part file"""
+        if not self.pending:
+            return
+        os.makedirs(self.path, exist_ok=True)
+        file = os.path.join(self.path, f"part_{self.n_parts:05d}.pkl")
+        part = {'keys': [key for key, _ in self.pending],
+                'frame': pd.concat([frame for _, frame in self.pending], ignore_index=True)}
+        pd.to_pickle(part, file + '.tmp')
+        os.replace(file + '.tmp', file)
+        self.n_parts += 1
+        self.pending = []
+
+    def frame(self):
+        """all results of the run as one dataframe"""
+        if not self.frames:
+            return pd.DataFrame()
+        return pd.concat(self.frames, ignore_index=True)
+
+    def clear(self):
+        """remove the checkpoint files (after the output of a finished run is written)"""
+        for file in self._parts():
+            os.remove(file)
+        self.keys, self.frames, self.pending, self.n_parts = set(), [], [], 0
@@ -0,0 +1,179 @@
+"""
+this module rebuilds the history of InflowFactorReturn in one pass:
+positions of all rebalances and a (trading day x code) close price matrix are loaded once, then the values of every
+day are computed with the same mechanism as Manager.cal_return (see README: Daily Return and Cumulative Value)
+"""
+import numpy as np
+import pandas as pd
+from inflow_factor_class import Manager, read_mysql, upload_return, print_with_time
+
+query_positions = """select date, strategy, recommendation, code from InflowFactor where date <= %s;"""
+
+query_prices = """
+select q.tradingday as tradingday, q.InnerCode as InnerCode, q.closePrice as closePrice from jydb.QT_HKBefRehDQuote q
+inner join (select distinct code from InflowFactor where date <= %s) f on f.code = q.InnerCode
+where q.tradingday between %s and %s;
+"""
+
+query_stored = """
+select date, strategy, side as recommendation, cumulative_return as cumulative_value from InflowFactorReturn
+where date < %s;
+"""
+
+
+def load_backfill_data(end_date, session=None):
+    """load positions of all rebalances up to end_date and close prices of their stocks (trading day x code)"""
+    positions = read_mysql(query_positions, end_date, session=session)
+    positions['date'] = pd.to_datetime(positions['date'])
+    start_date = positions['date'].min().strftime("%Y-%m-%d")
+    prices = read_mysql(query_prices, end_date, start_date, end_date, session=session)
+    prices['tradingday'] = pd.to_datetime(prices['tradingday'])
+    prices = prices.pivot_table(index='tradingday', columns='InnerCode', values='closePrice', aggfunc='last')
+    return positions, prices
+
+
+def _cal_discount(pos, reb_prices, costs, ls_cost):
+    """
+    discount of every (rebalance, strategy, side) and of every (rebalance, strategy) long-short portfolio,
+    same as Manager.cal_discount: positions of a rebalancing are priced at that and at the previous rebalancing date
+    """
+    keys = ['k', 'strategy', 'recommendation']
+    pos = pos.copy()
+    pos['r'] = pos['recommendation'].map(costs)
+    k, col = pos['k'].values, pos['col'].values
+    with np.errstate(invalid='ignore', divide='ignore'):
+        pos['cum_ret'] = np.where(k > 0, reb_prices[k, col] / reb_prices[np.maximum(k - 1, 0), col], np.nan)
+    pos['overall_ret'] = pos.groupby(keys).cum_ret.transform('sum')
+    pos['cnt2'] = pos.groupby(keys).code.transform('count')
+    pos['x'] = np.minimum(1 / pos['cnt2'], pos['cum_ret'] / pos['overall_ret'])
+
+    side = pos.groupby(keys).agg(x=('x', 'sum'), r=('r', 'first')).reset_index()
+    side['d'] = np.where(side['k'] > 0, (side['x'] * side['r'] + 1) / (1 + side['r']), 1 / (1 + side['r']))
+    side['xr'] = side['x'] * side['r']
+    ls = side.groupby(['k', 'strategy']).xr.sum().reset_index()
+    ls['d'] = np.where(ls['k'] > 0, ls['xr'] + 1, 1) / (1 + ls_cost)
+    ls['recommendation'] = 'long-short'
+    return pd.concat([side[keys + ['d']], ls[keys + ['d']]], ignore_index=True)
+
+
+def compute_returns(positions, prices, strategies=None, long_cost=Manager.long_cost, short_cost=Manager.short_cost,
+                    decimals=4, history=None, start_date=None):
+    """
+    compute daily return and cumulative value of every strategy and side on every trading day after the first
+    rebalance, reproducing Manager.cal_return run day by day (previous values are read back rounded to `decimals`
+    digits, as they are stored in InflowFactorReturn)
+    history: values stored before start_date (date, strategy, recommendation, cumulative_value); if given, only the
+    days from start_date are returned and they continue from the stored values (initial value on a rebalancing date
+    before start_date, last value of the previous day) instead of the recomputed ones, as Manager.get_history reads them
+    """
+    rebs = np.sort(positions['date'].unique())
+    strategies = strategies or sorted(positions['strategy'].unique())
+    pos = positions[positions['strategy'].isin(strategies)].reset_index(drop=True)
+
+    # price matrix with an extra all-nan row and column for missing dates and codes
+    days = prices.index.values
+    P = np.full((len(days) + 1, prices.shape[1] + 1), np.nan)
+    P[:-1, :-1] = prices.values
+    pos['col'] = prices.columns.get_indexer(pos['code'])
+    pos['k'] = np.searchsorted(rebs, pos['date'].values)
+    reb_prices = P[prices.index.get_indexer(rebs)]
+
+    # last rebalancing before each day
+    kt = np.searchsorted(rebs, days, side='left') - 1
+    days, kt, P_days = days[kt >= 0], kt[kt >= 0], P[:-1][kt >= 0]
+
+    # mean gross return of each (strategy, side) on each day, over positions of the last rebalancing
+    # (each period only prices its own days and positions)
+    group, group_keys = pd.factorize(pd.MultiIndex.from_frame(pos[['strategy', 'recommendation']]))
+    n_groups = len(group_keys)
+    raw = np.full((len(days), n_groups), np.nan)
+    pos_k, pos_col = pos['k'].values, pos['col'].values
+    for k in np.unique(kt):
+        rows, held = np.flatnonzero(kt == k), np.flatnonzero(pos_k == k)
+        if not len(held):
+            continue
+        with np.errstate(invalid='ignore', divide='ignore'):
+            gross = P_days[rows][:, pos_col[held]] / reb_prices[k, pos_col[held]]
+        valid = ~np.isnan(gross)
+        cell = (np.arange(len(rows))[:, None] * n_groups + group[held][None, :])[valid]
+        total = np.bincount(cell, weights=gross[valid], minlength=len(rows) * n_groups)
+        count = np.bincount(cell, minlength=len(rows) * n_groups)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            raw[rows] = (total / count).reshape(len(rows), n_groups)
+    t, g = np.nonzero(~np.isnan(raw))
+    raw = pd.DataFrame({'date': days[t], 'k': kt[t], 'strategy': group_keys.get_level_values(0)[g],
+                        'recommendation': group_keys.get_level_values(1)[g], 'raw_ret': raw[t, g]})
+
+    # long-short portfolio: long return - short return
+    raw['mul'] = np.where(raw['recommendation'] == 'long', 1, -1) * raw['raw_ret']
+    ls = raw.groupby(['date', 'k', 'strategy']).mul.sum().rename('raw_ret').reset_index()
+    ls['recommendation'] = 'long-short'
+    raw = pd.concat([raw.drop(columns='mul'), ls], ignore_index=True)
+
+    dis = _cal_discount(pos, reb_prices, {'long': long_cost, 'short': short_cost}, long_cost + short_cost)
+    perf = pd.merge(raw, dis, on=['k', 'strategy', 'recommendation'], how='left')
+    perf['cum_ret'] = perf['raw_ret'] * perf['d']
+    perf['growth'] = np.where(perf['recommendation'] == 'long-short', 1 + perf['cum_ret'], perf['cum_ret'])
+    perf = perf.sort_values(['strategy', 'recommendation', 'date']).reset_index(drop=True)
+
+    # chain cumulative values over rebalances: the initial value of a period is the (stored) value on its
+    # rebalancing date if a return was computed on that date, otherwise 1
+    perf['initial_value'] = 1.0
+    perf['cumulative_value'] = np.nan
+    reb_dates = pd.DatetimeIndex(rebs)
+    if history is not None:
+        start = pd.Timestamp(start_date)
+        history = history.assign(date=pd.to_datetime(history['date'])).sort_values('date')
+        stored = {key: df.set_index('date')['cumulative_value'].astype(float)
+                  for key, df in history.groupby(['strategy', 'recommendation'])}
+    for key, idx in perf.groupby(['strategy', 'recommendation']).groups.items():
+        periods = dict(list(perf.loc[idx].groupby('k')))
+        initial = 1.0
+        for k in range(len(rebs)):
+            if history is not None and reb_dates[k] < start:
+                # initial value of a period starting before start_date: value stored on its rebalancing date
+                initial = float(stored.get(key, pd.Series(dtype=float)).get(reb_dates[k], 1.0))
+            period = periods.get(k)
+            if period is None:
+                initial = 1.0
+                continue
+            perf.loc[period.index, 'initial_value'] = initial
+            perf.loc[period.index, 'cumulative_value'] = initial * period['growth']
+            if k + 1 < len(rebs):
+                on_reb = period.loc[period['date'] == reb_dates[k + 1], 'growth']
+                initial = round(initial * on_reb.iloc[0], decimals) if len(on_reb) else 1.0
+
+    # daily return against the (stored) value of the previous computed day
+    if history is not None:
+        perf = perf[perf['date'] >= start].reset_index(drop=True)
+    perf['last_value'] = perf.groupby(['strategy', 'recommendation']).cumulative_value.shift(1).round(decimals)
+    if history is not None:
+        # first day of each portfolio: last value stored before start_date
+        last = {key: values.iloc[-1] for key, values in stored.items()}
+        first = perf['last_value'].isna()
+        perf.loc[first, 'last_value'] = [last.get(key, np.nan) for key in
+                                         zip(perf.loc[first, 'strategy'], perf.loc[first, 'recommendation'])]
+    perf['last_value'] = perf['last_value'].fillna(1)
+    perf['daily_ret'] = perf['cumulative_value'] / perf['last_value'] - 1
+    perf['date'] = perf['date'].dt.strftime("%Y-%m-%d")
+    return perf[['date', 'strategy', 'recommendation', 'raw_ret', 'd', 'cum_ret', 'last_value', 'initial_value',
+                 'cumulative_value', 'daily_ret']]
+
+
+def backfill_returns(start_date, end_date, strategies=None, upload=False, session=None, keep_stored=False):
+    """
+    compute returns of all days between start_date and end_date and upload them into InflowFactorReturn if upload is
+    True; the history is rebuilt from the first rebalance, unless keep_stored is True: then the days continue from
+    the values already stored in InflowFactorReturn before start_date (catching up missed days)
+    """
+    positions, prices = load_backfill_data(end_date, session=session)
+    if keep_stored:
+        history = read_mysql(query_stored, start_date, session=session)
+        perf = compute_returns(positions, prices, strategies, history=history, start_date=start_date)
+    else:
+        perf = compute_returns(positions, prices, strategies)
+        perf = perf[perf['date'] >= start_date].reset_index(drop=True)
+    print_with_time(f"Computed returns of {perf['date'].nunique()} days ({start_date} to {end_date})")
+    if upload:
+        upload_return(perf, session=session)
+    return perf
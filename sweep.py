@@ -0,0 +1,279 @@
+"""
+this module runs the long-short backtest of analysis/long_short_backtest.py over a grid of parameters
+(n, m, lag, strategy, top / bottom quantiles, transaction costs and universe filters) on a pool of processes:
+the inflow prefix sums, listing intervals, close prices and market caps are copied once into shared memory and
+attached by every worker; a task builds the factors of one combination of (n, m, lag, filters) for all its rebalances
+at once and simulates every strategy / quantile / cost combination on them (see backtest_engine);
+the result of every cell is stored in data/sweep, keyed by its parameters and a fingerprint of the data,
+so a rerun only computes the cells that are not stored yet;
+the results of all cells are gathered into one table with one row per (cell, rebalancing date)
+
+usage (the pool starts new processes on windows, so the caller needs a `if __name__ == "__main__":` guard):
+    data = load_data(cnx)
+    table = sweep({'n': [5, 10], 'lag': range(1, 11), 'strategy': ['delta', 'neu', 'absneu']}, *data)
+"""
+import os
+import json
+import hashlib
+import itertools
+from multiprocessing import shared_memory
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import numpy as np
+import pandas as pd
+from panel_store import InflowPanelStore
+from listing_index import ListingIndex
+from forward_returns import load_quotes, holding_panel
+from transforms import winsorize, zscore, residualize
+from backtest_engine import simulate, columns
+
+default_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'sweep')
+
+# parameters of a cell and their default values (those of long_short_backtest.py):
+# n: days of the inflow window, m: days between rebalances (holding period), lag: the first rebalance is the
+# (n + lag)-th trading day, strategy: factor used for ranking (delta, neu or absneu), top / bottom: rank quantiles
+# bought / sold, rate_long / rate_short: transaction costs, min_mktcap / min_price: filters of the market cap and
+# close price, min_avg: minimum absolute average inflow of the window (no filter if None),
+# mk_shift: the market cap is taken mk_shift trading days before the first day of the window
+defaults = {'n': 10, 'm': 10, 'lag': 1, 'strategy': 'delta', 'top': 0.95, 'bottom': 0.05, 'rate_long': 0.0015,
+            'rate_short': 0.0025, 'min_mktcap': 5000000000, 'min_price': None, 'min_avg': None, 'mk_shift': 0}
+
+# parameters of the factors, cells with the same values share the factor construction
+factor_params = ('n', 'm', 'lag', 'min_mktcap', 'min_price', 'min_avg', 'mk_shift')
+
+strategies = ('delta', 'neu', 'absneu')
+
+
+def _plain(value):
+    return value.item() if isinstance(value, np.generic) else value
+
+
+def expand(grid):
+    """
+    cells of the grid, grid: dict parameter -> value or list of values (all combinations are taken),
+    or a list of such dicts (union of their cells); parameters that are not given take their default value
+    """
+    cells, seen = [], set()
+    for sub in ([grid] if isinstance(grid, dict) else grid):
+        unknown = set(sub) - set(defaults)
+        if unknown:
+            raise ValueError(f"unknown sweep parameters {sorted(unknown)}")
+        axes = {name: sub.get(name, value) for name, value in defaults.items()}
+        axes = {name: list(v) if isinstance(v, (list, tuple, range, np.ndarray)) else [v] for name, v in axes.items()}
+        for values in itertools.product(*axes.values()):
+            cell = {name: _plain(v) for name, v in zip(axes, values)}
+            if cell['strategy'] not in strategies:
+                raise ValueError(f"unknown strategy {cell['strategy']}")
+            key = json.dumps(cell, sort_keys=True)
+            if key not in seen:
+                seen.add(key)
+                cells.append(cell)
+    return cells
+
+
+def load_data(con, cache=None):
+    """
+    update the local inflow panel and load what the sweep needs: panel, listing index, close prices and market caps
+    of all its trading days (through cache if a QueryCache is given)
+    """
+    panel = InflowPanelStore().update(con)
+    listing = ListingIndex.from_panel(panel)
+    close, mktcap = load_quotes(con, panel.trading_days().date, cache=cache)
+    return panel, listing, close, mktcap
+
+
+def fingerprint(panel, close, mktcap):
+    """hash of the data, stored cells of other data (e.g. before the panel was updated) are not reused"""
+    h = hashlib.sha256()
+    with np.errstate(invalid='ignore'):
+        for arr in (panel.dates, panel.codes, np.asarray(panel.cum_amount[-1]), np.asarray(panel.cum_count[-1]),
+                    close.index.values, close.columns.values, np.nansum(close.values, axis=0),
+                    mktcap.index.values, np.nansum(mktcap.values, axis=0)):
+            h.update(np.ascontiguousarray(arr).tobytes())
+    return h.hexdigest()[:16]
+
+
+def build_factors(panel, listing, close, mktcap, n, m, lag, min_mktcap=None, min_price=None, min_avg=None,
+                  mk_shift=0, sig=3.5):
+    """
+    factors delta, neu and absneu of every rebalance of long_short_backtest.py (every m trading days from the
+    (n + lag)-th one), computed for all rebalances at once;
+    returns one row per (date, Code) with the forward return 'ret' until the next rebalance and 'mktcap'
+    (rebalances with fewer than three stocks are left out)
+    """
+    dates = pd.DatetimeIndex(panel.dates)
+    reb = np.arange(n + lag, len(dates) - m, m)
+    out = ['date', 'Code', 'ret', 'mktcap'] + list(strategies)
+    if len(reb) == 0:
+        return pd.DataFrame(columns=out)
+    start = reb - n + 1
+
+    # inflow sums of the windows, without banned stocks and stocks without records
+    total, cnt = panel.window_sums(start, reb + 1)
+    keep = cnt > 0
+    for k, i in enumerate(reb):
+        keep[k] &= ~np.isin(panel.codes, listing.ban_list(i))
+    if min_avg is not None:
+        with np.errstate(invalid='ignore', divide='ignore'):
+            keep &= np.abs(total / cnt) > min_avg
+    r, c = np.nonzero(keep)
+    inflow = pd.DataFrame({'key': r, 'InnerCode': panel.codes[c], 'delta': total[r, c]})
+
+    # forward returns and market caps (key is the position of the rebalance)
+    plan = pd.DataFrame({'t2': dates[reb], 't3': dates[reb + m], 'mk': dates[start - mk_shift]})
+    holding = holding_panel(close, mktcap, plan, {'ret': 't3'}, min_mktcap=min_mktcap, min_price=min_price)
+    df = pd.merge(holding, inflow, on=['key', 'InnerCode'])
+    df = df[df.groupby('key')['key'].transform('size') >= 3].reset_index(drop=True)
+
+    # cleaning and neutralization within each rebalance (as winNstand and linregress in the scripts)
+    g = df['key'].values
+    df['delta'] = zscore(winsorize(df['delta'], sig, groups=g), groups=g)
+    df['mktcap'] = winsorize(df['mktcap'], sig, groups=g)
+    mktcap_log = np.log(df['mktcap'])
+    df['neu'] = residualize(df['delta'], mktcap_log, groups=g)
+    df['absneu'] = residualize(df['delta'].abs(), mktcap_log, groups=g) * np.where(df['delta'] > 0, 1, -1)
+
+    df['date'] = dates[reb].strftime("%Y-%m-%d").values[g]
+    return df.rename(columns={'InnerCode': 'Code'})[out]
+
+
+def _cell_key(cell, data_key):
+    return hashlib.sha256(json.dumps({**cell, 'data': data_key}, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def _file(path, key):
+    return os.path.join(path, f"{key}.pkl")
+
+
+def _save(path, results):
+    os.makedirs(path, exist_ok=True)
+    for key, frame in results.items():
+        frame.to_pickle(_file(path, key) + '.tmp')
+        os.replace(_file(path, key) + '.tmp', _file(path, key))
+
+
+def run_task(data, factor_cell, cells):
+    """
+    build the factors of factor_cell and simulate the cells (key -> cell) that share them,
+    returns key -> result of the cell
+    """
+    factors = build_factors(*data, **factor_cell)
+    results = {}
+    sim_params = [p for p in defaults if p not in factor_params and p != 'strategy']
+    groups = {}
+    for key, cell in cells.items():
+        groups.setdefault(tuple(cell[p] for p in sim_params), []).append((key, cell))
+    for members in groups.values():
+        cell = members[0][1]
+        names = list(dict.fromkeys(c['strategy'] for _, c in members))
+        if factors.empty:
+            sim = pd.DataFrame(columns=columns)
+        else:
+            sim = simulate(factors, names, cell['top'], cell['bottom'], cell['rate_long'], cell['rate_short'])
+        for key, c in members:
+            frame = sim[sim['strategy'] == c['strategy']].drop(columns='strategy').reset_index(drop=True)
+            for i, name in enumerate(defaults):
+                frame.insert(i, name, c[name])
+            results[key] = frame
+    return results
+
+
+# data attached by a worker process, shared memory blocks are kept open while it runs
+_worker = {}
+
+
+def _arrays(panel, listing, close, mktcap):
+    return {'dates': panel.dates, 'codes': panel.codes, 'cum_amount': panel.cum_amount, 'cum_count': panel.cum_count,
+            'listing_dates': listing.dates, 'listing_codes': listing.codes, 'first': listing.first,
+            'last': listing.last, 'close': close.values, 'close_dates': close.index.values,
+            'close_codes': close.columns.values, 'mktcap': mktcap.values, 'mktcap_dates': mktcap.index.values,
+            'mktcap_codes': mktcap.columns.values}
+
+
+def _from_arrays(a):
+    panel = InflowPanelStore(path=None)
+    panel.dates, panel.codes, panel.cum_amount, panel.cum_count = a['dates'], a['codes'], a['cum_amount'], a['cum_count']
+    listing = ListingIndex(path=None)
+    listing.dates, listing.codes, listing.first, listing.last = \
+        a['listing_dates'], a['listing_codes'], a['first'], a['last']
+    close = pd.DataFrame(a['close'], index=pd.DatetimeIndex(a['close_dates']), columns=a['close_codes'], copy=False)
+    mktcap = pd.DataFrame(a['mktcap'], index=pd.DatetimeIndex(a['mktcap_dates']), columns=a['mktcap_codes'],
+                          copy=False)
+    return panel, listing, close, mktcap
+
+
+def _share(arrays):
+    """copy the arrays into shared memory blocks, returns the blocks and the spec used by the workers to attach them"""
+    blocks, spec = [], {}
+    try:
+        for name, arr in arrays.items():
+            arr = np.ascontiguousarray(arr)
+            block = shared_memory.SharedMemory(create=True, size=max(arr.nbytes, 1))
+            blocks.append(block)
+            np.ndarray(arr.shape, arr.dtype, buffer=block.buf)[...] = arr
+            spec[name] = (block.name, arr.shape, arr.dtype.str)
+    except BaseException:
+        _release(blocks)
+        raise
+    return blocks, spec
+
+
+def _release(blocks):
+    for block in blocks:
+        block.close()
+        block.unlink()
+
+
+def _attach(spec):
+    """worker initializer: attach the shared arrays (read-only views)"""
+    blocks, arrays = [], {}
+    for name, (block_name, shape, dtype) in spec.items():
+        block = shared_memory.SharedMemory(name=block_name)
+        blocks.append(block)
+        arrays[name] = np.ndarray(shape, dtype, buffer=block.buf)
+        arrays[name].flags.writeable = False
+    _worker['blocks'] = blocks
+    _worker['data'] = _from_arrays(arrays)
+
+
+def _run_worker_task(factor_cell, cells):
+    return run_task(_worker['data'], factor_cell, cells)
+
+
+def sweep(grid, panel, listing, close, mktcap, workers=None, path=default_path, refresh=False):
+    """
+    run the backtest of every cell of the grid (see expand) on the loaded data (see load_data),
+    cells stored in path by previous runs on the same data are read instead of computed (all are recomputed if
+    refresh), the others are computed by `workers` processes (all cpus if None, in this process if 1);
+    returns one row per (cell, rebalancing date): the parameters of the cell, then the columns of backtest_engine
+    """
+    cells = expand(grid)
+    data_key = fingerprint(panel, close, mktcap)
+    keys = [_cell_key(cell, data_key) for cell in cells]
+
+    # cells to compute, grouped by their factor parameters
+    tasks = {}
+    for key, cell in zip(keys, cells):
+        if refresh or not os.path.exists(_file(path, key)):
+            factor_cell = {p: cell[p] for p in factor_params}
+            tasks.setdefault(json.dumps(factor_cell, sort_keys=True), (factor_cell, {}))[1][key] = cell
+    todo = sum(len(task[1]) for task in tasks.values())
+    print(f"sweep: {len(cells)} cells, {len(cells) - todo} stored, {todo} to compute in {len(tasks)} tasks")
+
+    workers = min(workers or os.cpu_count() or 1, len(tasks))
+    if workers == 1:
+        for factor_cell, task_cells in tasks.values():
+            _save(path, run_task((panel, listing, close, mktcap), factor_cell, task_cells))
+    elif workers > 1:
+        blocks, spec = _share(_arrays(panel, listing, close, mktcap))
+        try:
+            with ProcessPoolExecutor(workers, initializer=_attach, initargs=(spec,)) as pool:
+                futures = [pool.submit(_run_worker_task, *task) for task in tasks.values()]
+                for done, future in enumerate(as_completed(futures), 1):
+                    _save(path, future.result())
+                    print(f"sweep: {done}/{len(futures)} tasks done")
+        finally:
+            _release(blocks)
+
+    frames = [pd.read_pickle(_file(path, key)) for key in keys]
+    return pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(
+        columns=list(defaults) + [c for c in columns if c != 'strategy'])
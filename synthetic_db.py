@@ -0,0 +1,283 @@
+"""
+this module generates synthetic versions of the database tables used by the project
+(AlternativeData.ChangeHoldAmountSM, InflowFactor, InflowFactorReturn and jydb.QT_HKBefRehDQuote,
+QT_HKDailyQuoteIndex, HK_SecuMain, LC_SHSZHSCHoldings) at a configurable scale (stocks x trading days)
+and loads them into sqlite files that stand in for mysql:
+SyntheticSession is a Session whose engine reads these files (the mysql placeholders, schema names and functions used
+by the queries are translated on the fly) and whose mongo client is in memory (mongomock),
+so the classes and functions of the project run unchanged against it (e.g. for benchmarks)
+"""
+import os
+import re
+import json
+import shutil
+import sqlite3
+import datetime
+import numpy as np
+import pandas as pd
+from sqlalchemy import create_engine
+from sqlalchemy.pool import QueuePool
+from session import Session
+
+default_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'synthetic')
+
+schema = {
+    'main': [
+        """create table ChangeHoldAmountSM (Date date, InnerCode integer, code integer, change_amount real)""",
+        """create index idx_inflow_date on ChangeHoldAmountSM (Date, InnerCode)""",
+        """create table InflowFactor (date date, code integer, secuabbr text, ticker text, change_amount real,
+        factor_value real, strategy text, recommendation text)""",
+        """create index idx_factor_date on InflowFactor (date, strategy)""",
+        """create table InflowFactorReturn (date date, strategy text, side text, daily_return real,
+        cumulative_return real, unique (date, strategy, side))""",
+    ],
+    'jydb': [
+        """create table jydb.QT_HKBefRehDQuote (TradingDay date, InnerCode integer, ClosePrice real)""",
+        """create index jydb.idx_quote_date on QT_HKBefRehDQuote (TradingDay, InnerCode)""",
+        """create table jydb.QT_HKDailyQuoteIndex (TradingDay date, InnerCode integer, HKStkMV real)""",
+        """create index jydb.idx_mktcap_date on QT_HKDailyQuoteIndex (TradingDay, InnerCode)""",
+        """create table jydb.HK_SecuMain (InnerCode integer primary key, SecuCode text, SecuAbbr text, ChiName text)""",
+        """create table jydb.LC_SHSZHSCHoldings (EndDate date, TradingType integer, InfoSource integer)""",
+        """create index jydb.idx_holdings_date on LC_SHSZHSCHoldings (EndDate)""",
+    ],
+}
+
+# tables of each sqlite file (AlternativeData is the main database, jydb is attached)
+tables = {'main': ['ChangeHoldAmountSM', 'InflowFactor', 'InflowFactorReturn'],
+          'jydb': ['QT_HKBefRehDQuote', 'QT_HKDailyQuoteIndex', 'HK_SecuMain', 'LC_SHSZHSCHoldings']}
+
+_date = re.compile(r'^\d{4}-\d{2}-\d{2}$')
+
+
+def make_tables(n_stocks=500, n_days=500, start_date='2021-01-04', seed=0, quantile=0.05,
+                strategies=('pure', 'neu', 'absneu')):
+    """
+    synthetic tables as dataframes (dates as "%Y-%m-%d" strings):
+    trading days are the weekdays from start_date without a few random holidays (never on fridays),
+    15% of the stocks are listed after the first day, every stock has an inflow record on 97% of its listed days,
+    prices follow random walks and market caps are spread around 5e9 (the investable threshold);
+    InflowFactor holds random long/short portfolios (quantile of the listed stocks) of every rebalancing friday
+    """
+    rng = np.random.default_rng(seed)
+    weekdays = pd.bdate_range(start_date, periods=int(n_days * 1.03) + 10)
+    holiday = (rng.random(len(weekdays)) < 0.03) & (weekdays.weekday != 4)
+    days = weekdays[~holiday][:n_days]
+    ds = days.strftime("%Y-%m-%d").values
+    codes = np.arange(1001, 1001 + n_stocks)
+
+    # listing day of every stock
+    first = np.where(rng.random(n_stocks) < 0.85, 0, rng.integers(0, n_days, n_stocks))
+    listed = np.arange(n_days)[:, None] >= first[None, :]
+    t, c = np.nonzero(listed)
+
+    # inflow records
+    rec = rng.random(len(t)) < 0.97
+    scale = np.exp(rng.normal(13, 1.5, n_stocks))
+    inflow = pd.DataFrame({'Date': ds[t[rec]], 'InnerCode': codes[c[rec]], 'code': codes[c[rec]],
+                           'change_amount': rng.standard_t(4, rec.sum()) * scale[c[rec]]})
+
+    # prices and market caps
+    price = rng.uniform(1, 80, n_stocks) * np.exp(np.cumsum(rng.normal(0, 0.02, (n_days, n_stocks)), axis=0))
+    shares = np.exp(rng.normal(np.log(5e9 / 20), 1.5, n_stocks))
+    quote = pd.DataFrame({'TradingDay': ds[t], 'InnerCode': codes[c], 'ClosePrice': price[t, c].round(3)})
+    mktcap = pd.DataFrame({'TradingDay': ds[t], 'InnerCode': codes[c], 'HKStkMV': (price[t, c] * shares[c]).round(0)})
+
+    secu = pd.DataFrame({'InnerCode': codes, 'SecuCode': [f"{k:05d}" for k in codes - 1000],
+                         'SecuAbbr': [f"STOCK {k}" for k in codes], 'ChiName': [f"股票{k}" for k in codes]})
+    holdings = pd.DataFrame({'EndDate': ds, 'TradingType': 5, 'InfoSource': 72})
+
+    # portfolios of the rebalancing fridays (every two weeks from 2022-03-04, see TradingCalendar)
+    fridays = days[(days.weekday == 4) & (((days - pd.Timestamp('2022-03-04')).days // 7) % 2 == 0)]
+    portfolios = []
+    for d in fridays:
+        k = days.get_loc(d)
+        pool = codes[listed[k]]
+        n = max(int(len(pool) * quantile), 1)
+        for strategy in strategies:
+            picked = rng.permutation(pool)[:2 * n]
+            for side, chosen in (('long', picked[:n]), ('short', picked[n:])):
+                portfolios.append(pd.DataFrame({'date': d.strftime("%Y-%m-%d"), 'code': chosen,
+                                                'secuabbr': [f"STOCK {k}" for k in chosen],
+                                                'ticker': [f"{k:05d}" for k in chosen - 1000],
+                                                'change_amount': rng.normal(0, 1, n).round(4),
+                                                'factor_value': rng.normal(0, 1, n).round(4),
+                                                'strategy': strategy, 'recommendation': side}))
+    factor = pd.concat(portfolios, ignore_index=True) if portfolios else \
+        pd.DataFrame(columns=['date', 'code', 'secuabbr', 'ticker', 'change_amount', 'factor_value', 'strategy',
+                              'recommendation'])
+    ret = pd.DataFrame(columns=['date', 'strategy', 'side', 'daily_return', 'cumulative_return'])
+
+    return {'ChangeHoldAmountSM': inflow, 'InflowFactor': factor, 'InflowFactorReturn': ret,
+            'QT_HKBefRehDQuote': quote, 'QT_HKDailyQuoteIndex': mktcap, 'HK_SecuMain': secu,
+            'LC_SHSZHSCHoldings': holdings}
+
+
+def _weekday(value):
+    """mysql weekday(): monday is 0"""
+    if value is None:
+        return None
+    return datetime.date.fromisoformat(str(value)[:10]).weekday()
+
+
+def _param(value):
+    """python value of a query parameter as stored in sqlite (dates as "%Y-%m-%d" strings)"""
+    if isinstance(value, np.datetime64):
+        value = pd.Timestamp(value)
+    if isinstance(value, datetime.datetime):
+        return value.strftime("%Y-%m-%d") if value.time() == datetime.time() else value.isoformat(sep=' ')
+    if isinstance(value, datetime.date):
+        return value.isoformat()
+    if isinstance(value, np.generic):
+        return value.item()
+    return value
+
+
+def _value(value):
+    """dates are returned as datetime like the mysql driver does"""
+    if isinstance(value, str) and _date.match(value):
+        return datetime.datetime.strptime(value, "%Y-%m-%d")
+    return value
+
+
+def translate(query):
+    """mysql query -> sqlite query: placeholders %s / %(name)s and the default AlternativeData schema"""
+    query = re.sub(r'%\((\w+)\)s', r':\1', query).replace('%s', '?')
+    return re.sub(r'\bAlternativeData\.', '', query, flags=re.IGNORECASE)
+
+
+def _params(params):
+    if isinstance(params, dict):
+        return {k: _param(v) for k, v in params.items()}
+    return [_param(v) for v in params]
+
+
+class StandInCursor(sqlite3.Cursor):
+    """
+    sqlite cursor that accepts the mysql queries of the project;
+    result columns are named as spelled in the query (sqlite uses the spelling of the table definition)
+    """
+    query = ''
+
+    def execute(self, query, params=()):
+        self.query = translate(query)
+        return super().execute(self.query, _params(params))
+
+    def executemany(self, query, seq):
+        self.query = translate(query)
+        return super().executemany(self.query, [_params(p) for p in seq])
+
+    @property
+    def description(self):
+        description = super().description
+        if description is None:
+            return None
+        named = []
+        for col in description:
+            word = r'(?<![\w`])' + re.escape(col[0]) + r'(?![\w`])'
+            spelled = None if re.search(word, self.query) else re.search(word, self.query, flags=re.IGNORECASE)
+            named.append((spelled.group(0) if spelled else col[0],) + tuple(col[1:]))
+        return tuple(named)
+
+    def fetchone(self):
+        row = super().fetchone()
+        return None if row is None else tuple(_value(v) for v in row)
+
+    def fetchmany(self, size=None):
+        rows = super().fetchmany(self.arraysize if size is None else size)
+        return [tuple(_value(v) for v in row) for row in rows]
+
+    def fetchall(self):
+        return [tuple(_value(v) for v in row) for row in super().fetchall()]
+
+
+class StandInConnection(sqlite3.Connection):
+    def cursor(self, factory=StandInCursor):
+        return super().cursor(factory)
+
+    def execute(self, query, params=()):
+        return self.cursor().execute(query, params)
+
+    def executemany(self, query, seq):
+        return self.cursor().executemany(query, seq)
+
+
+def connect(path):
+    """connection to the synthetic database in directory path (jydb attached)"""
+    con = sqlite3.connect(os.path.join(path, 'AlternativeData.db'), factory=StandInConnection,
+                          check_same_thread=False, timeout=60)
+    con.execute(f"attach database '{os.path.join(path, 'jydb.db')}' as jydb")
+    con.create_function('weekday', 1, _weekday, deterministic=True)
+    return con
+
+
+def build(path=None, n_stocks=500, n_days=500, start_date='2021-01-04', seed=0):
+    """
+    generate the tables and write them into sqlite files in path (default data/synthetic/<n_stocks>x<n_days>_<seed>),
+    an existing database built with the same settings is reused; returns the path
+    """
+    settings = {'n_stocks': n_stocks, 'n_days': n_days, 'start_date': start_date, 'seed': seed}
+    path = path or os.path.join(default_dir, f"{n_stocks}x{n_days}_{seed}")
+    meta = os.path.join(path, 'meta.json')
+    if os.path.exists(meta):
+        with open(meta) as f:
+            if json.load(f) == settings:
+                return path
+
+    os.makedirs(path, exist_ok=True)
+    for name in ['AlternativeData.db', 'jydb.db', 'meta.json']:
+        if os.path.exists(os.path.join(path, name)):
+            os.remove(os.path.join(path, name))
+    data = make_tables(n_stocks, n_days, start_date, seed)
+    con = connect(path)
+    for db in ['main', 'jydb']:
+        for ddl in schema[db]:
+            con.execute(ddl)
+        for table in tables[db]:
+            frame = data[table]
+            columns = ','.join(frame.columns)
+            marks = ','.join(['?'] * frame.shape[1])
+            # plain sqlite3 cursor: the values are already in their stored format
+            sqlite3.Cursor(con).executemany(f"insert into {db}.{table} ({columns}) values ({marks})",
+                                            frame.itertuples(index=False, name=None))
+    con.commit()
+    con.close()
+
+    with open(meta, 'w') as f:
+        json.dump(settings, f)
+    return path
+
+
+class SyntheticSession(Session):
+    """
+    session on a synthetic database built by build(): pooled sqlalchemy engine on the sqlite files,
+    in-memory mongo client, and local stores kept in <path>/stores instead of data/
+    """
+
+    def __init__(self, path, pool_size=5, max_overflow=5):
+        super().__init__(mysql_url="sqlite://", mongo_url=None, pool_size=pool_size, max_overflow=max_overflow,
+                         data_dir=os.path.join(path, 'stores'))
+        self.path = path
+
+    @property
+    def engine(self):
+        if self._engine is None:
+            self._engine = create_engine(self.mysql_url, creator=lambda: connect(self.path), poolclass=QueuePool,
+                                         **self.pool_options)
+        return self._engine
+
+    @property
+    def mongo(self):
+        if self._mongo is None:
+            import mongomock
+            self._mongo = mongomock.MongoClient()
+        return self._mongo
+
+    def clear_stores(self):
+        """remove the local stores, so the next queries rebuild them (cold start)"""
+        if os.path.isdir(self.data_dir):
+            for f in os.listdir(self.data_dir):
+                f = os.path.join(self.data_dir, f)
+                if os.path.isdir(f):
+                    shutil.rmtree(f)
+                else:
+                    os.remove(f)
@@ -0,0 +1,27 @@
+"""
+fixtures of the tests: a small synthetic database (see synthetic_db) built once per test run,
+and a session on a fresh copy of it for every test, so tests that upload results do not affect each other
+"""
+import os
+import sys
+import shutil
+import pytest
+
+# make modules in the project root importable from the tests
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import synthetic_db
+
+
+@pytest.fixture(scope='session')
+def synthetic_path(tmp_path_factory):
+    return synthetic_db.build(str(tmp_path_factory.mktemp('synthetic')), n_stocks=150, n_days=400)
+
+
+@pytest.fixture
+def session(synthetic_path, tmp_path):
+    path = str(tmp_path / 'db')
+    shutil.copytree(synthetic_path, path)
+    session = synthetic_db.SyntheticSession(path)
+    session.clear_stores()
+    yield session
+    session.close()
@@ -0,0 +1,67 @@
+import os
+import numpy as np
+import pandas as pd
+from backtest_engine import simulate
+from forward_returns import load_quotes
+from listing_index import ListingIndex
+from panel_store import InflowPanelStore
+from sweep import build_factors
+
+strategies = ['delta', 'neu', 'absneu']
+
+
+def loop_backtest(panel, top=0.95, bottom=0.05, rate_long=0.0015, rate_short=0.0025, n=5):
+    """the per-rebalance dataframe loop of analysis/long_short_backtest.py"""
+    d, M, out = {}, {}, []
+    cost = 1 + rate_long + rate_short
+    for s in strategies:
+        d[s + "_long"] = pd.DataFrame(columns=["Code", "amount", "ret"])
+        d[s + "_short"] = pd.DataFrame(columns=["Code", "amount", "ret"])
+        M[s] = 1
+    for t2, data_df in panel.groupby('date', sort=True):
+        data_df = data_df.copy()
+        for s in strategies:
+            data_df[s + "_rank"] = data_df[s].rank(pct=True)
+            new_long = data_df.loc[data_df[s + "_rank"] >= top, ["Code", "ret"]]
+            new_short = data_df.loc[data_df[s + "_rank"] <= bottom, ["Code", "ret"]]
+            long_pos, short_pos = d[s + "_long"], d[s + "_short"]
+            long_pos.amount = long_pos.amount * (1 + long_pos.ret)
+            short_pos.amount = short_pos.amount * (1 + short_pos.ret)
+            cap_long, cap_short = long_pos.amount.sum(), short_pos.amount.sum()
+            net = [(cap_long - cap_short) / M[s], cap_long / M[s] - 1, cap_short / M[s] - 1]
+            M[s] += cap_long - cap_short
+
+            remove_long = np.where(long_pos.Code.isin(new_long.Code), 0, 1).sum()
+            remove_short = np.where(short_pos.Code.isin(new_short.Code), 0, 1).sum()
+            new_long["amount"] = M[s] / new_long.shape[0] / cost
+            new_short["amount"] = M[s] / new_short.shape[0] / cost
+            stay_long = np.where(long_pos.Code.isin(new_long.Code),
+                                 np.minimum(long_pos.amount, M[s] / new_long.shape[0] / cost), 0).sum()
+            stay_short = np.where(short_pos.Code.isin(new_short.Code),
+                                  np.minimum(short_pos.amount, M[s] / new_short.shape[0] / cost), 0).sum()
+            new_long["amount"] += (rate_long * stay_long + rate_short * stay_short) / cost / new_long.shape[0]
+            new_short["amount"] += (rate_long * stay_long + rate_short * stay_short) / cost / new_short.shape[0]
+
+            level = lambda rows: (data_df.loc[rows, "mktcap"].mean() - data_df.mktcap.mean()) / data_df.mktcap.std()
+            d[s + "_long"], d[s + "_short"] = new_long, new_short
+            out.append([t2, n, s, M[s]] + net + [new_long.shape[0], new_short.shape[0], remove_long, remove_short,
+                                                 level(data_df[s + "_rank"] >= top),
+                                                 level(data_df[s + "_rank"] <= bottom)])
+    return pd.DataFrame(out, columns=["date", "n", "strategy", "M", "net_ret", "net_long", "net_short", "no_long",
+                                      "no_short", "remove_long", "remove_short", "mktcap_long", "mktcap_short"])
+
+
+def test_simulate_matches_loop(session, tmp_path):
+    panel = InflowPanelStore(str(tmp_path / 'panel')).build(session.engine)
+    listing = ListingIndex.from_panel(panel, os.path.join(str(tmp_path), 'listing_index.npz'))
+    close, mktcap = load_quotes(session.engine, panel.trading_days().date)
+    factors = build_factors(panel, listing, close, mktcap, 5, 10, 1, min_mktcap=5000000000)
+    assert factors['date'].nunique() > 20
+
+    for top, bottom in [(0.95, 0.05), (0.8, 0.2)]:
+        expected = loop_backtest(factors, top, bottom)
+        got = simulate(factors, strategies, top, bottom, labels={'n': 5})
+        assert list(got.columns) == list(expected.columns)
+        assert (got[['date', 'strategy']].values == expected[['date', 'strategy']].values).all()
+        numeric = expected.columns[3:]
+        np.testing.assert_allclose(got[numeric].astype(float), expected[numeric].astype(float), rtol=1e-9)
@@ -0,0 +1,15 @@
+import numpy as np
+import inflow_factor_class as ifc
+from factor_engine import get_factor_panel
+from panel_store import InflowPanelStore
+
+
+def test_panel_matches_get_factor_data(session, tmp_path):
+    store = InflowPanelStore(str(tmp_path / 'panel')).build(session.engine)
+    panel = get_factor_panel('2021-06-01', '2022-07-29', store=store, session=session)
+    for ref_date in ['2021-06-04', '2021-11-19', '2022-03-04', '2022-07-22']:
+        expected = ifc.get_factor_data(ref_date, session=session).set_index('InnerCode').sort_index()
+        got = panel[panel.ref_date == ref_date].set_index('InnerCode').sort_index()
+        assert len(expected) > 10 and got.index.tolist() == expected.index.tolist()
+        for col in ['mktcap_log', 'pure', 'neu', 'absneu']:
+            np.testing.assert_allclose(got[col], expected[col], rtol=1e-9, atol=1e-12)
@@ -0,0 +1,40 @@
+import numpy as np
+import pandas as pd
+from factor_engine import get_factor_panel
+from forward_returns import load_quotes, holding_panel
+from ic_engine import rank_ic
+from panel_store import InflowPanelStore
+from analysis.params import Factor
+
+
+def factor_returns(session, tmp_path):
+    """factors of every fifth trading day with their 5, 10 and 30 day forward returns"""
+    store = InflowPanelStore(str(tmp_path / 'panel')).build(session.engine)
+    days = pd.DatetimeIndex(store.dates)
+    anchors = np.arange(80, len(days) - 30, 5)
+    plan = pd.DataFrame({'t2': days[anchors], 't3': days[anchors + 5], 't4': days[anchors + 10],
+                         't5': days[anchors + 30]})
+    plan['mk'] = plan['t2']
+    close, mktcap = load_quotes(session.engine, days)
+    holding = holding_panel(close, mktcap, plan, {'ret1': 't3', 'ret2': 't4', 'ret3': 't5'})
+    holding['date'] = plan['t2'].values[holding['key']]
+    factors = get_factor_panel(days[anchors[0]], days[anchors[-1]], store=store, session=session)
+    factors = factors.rename(columns={'ref_date': 'date'}).drop(columns='mktcap')
+    return pd.merge(holding, factors, on=['date', 'InnerCode']).sort_values(['date', 'InnerCode'])
+
+
+def test_rank_ic_matches_spearmanr(session, tmp_path):
+    panel = factor_returns(session, tmp_path).reset_index(drop=True)
+    panel['absneu_rank'] = panel.groupby('date')['absneu'].rank(pct=True)
+    tails = ((panel.absneu_rank <= 0.2) | (panel.absneu_rank >= 0.8)).values
+    columns = {'pure': 'pure', 'neu': 'neu', 'absneu': 'absneu', 'tails': 'absneu'}
+
+    result = rank_ic(panel, columns, ['ret1', 'ret2', 'ret3'], masks={'tails': tails})
+    for name, col in columns.items():
+        expected, got = Factor(name), Factor(name)
+        for t, df in panel.groupby('date'):
+            expected.getIC(df[tails[df.index]] if name == 'tails' else df, col, t)
+        got.setIC(result)
+        assert len(expected.values) > 20 and list(got.values) == list(expected.values)
+        np.testing.assert_allclose(pd.DataFrame(got.values).values, pd.DataFrame(expected.values).values,
+                                   rtol=1e-9, atol=1e-12)
@@ -0,0 +1,81 @@
+import numpy as np
+import pandas as pd
+import inflow_factor_class as ifc
+from listing_index import ListingIndex
+
+query_ban = """
+Select innercode from ChangeHoldAmountSM
+group by innercode having min(date) >=
+(Select distinct date from ChangeHoldAmountSM where date <= %s order by date desc limit 1 offset 59);
+"""
+
+query_date = """
+select date, sum(case when change_amount <> 0 then 1 else 0 end) as total from AlternativeData.ChangeHoldAmountSM
+group by date order by date
+"""
+
+# query_status of the analysis scripts, with the first day of the synthetic records instead of 2017-03-17
+query_status = """
+Select code, min(date) as start_date, max(date) as end_date from AlternativeData.ChangeHoldAmountSM
+group by code
+having start_date != %s or end_date != %s;
+"""
+
+
+def get_ban_list(ban_df, tradeday_df, i):
+    """ban list of the analysis scripts before the listing index"""
+    if i <= 60:
+        ban_ls = ban_df.loc[ban_df.end_date <= tradeday_df.at[i + 60, "date"], 'code'].tolist()
+    elif i >= tradeday_df.shape[0] - 60:
+        ban_ls = ban_df.loc[ban_df.start_date >= tradeday_df.at[i - 60, "date"], 'code'].tolist()
+    else:
+        ban_ls = ban_df.loc[(ban_df.end_date <= tradeday_df.at[i + 60, "date"]) & (
+                ban_df.start_date >= tradeday_df.at[i - 60, "date"]), 'code'].tolist()
+    return ban_ls
+
+
+def test_banned_matches_query_ban(session, tmp_path):
+    index = ListingIndex(str(tmp_path / 'listing.npz')).update(session.engine)
+    # fewer than 60 trading days: the threshold of query_ban is null in mysql and nothing is banned
+    assert not len(index.banned('2021-02-01'))
+    for ref_date in ['2021-04-01', '2021-09-17', '2022-03-04', '2022-08-02']:
+        expected = ifc.read_mysql(query_ban, ref_date, session=session)['innercode'].astype(np.int64)
+        assert sorted(index.banned(ref_date).tolist()) == sorted(expected.tolist())
+        # eligible stocks are the other stocks already listed on ref_date
+        listed = ifc.read_mysql("select distinct InnerCode from ChangeHoldAmountSM where date <= %s", ref_date,
+                                session=session)['InnerCode'].astype(np.int64)
+        assert sorted(index.eligible(ref_date).tolist()) == sorted(set(listed) - set(expected))
+
+
+def test_ban_list_matches_get_ban_list(session, tmp_path):
+    index = ListingIndex(str(tmp_path / 'listing.npz')).update(session.engine)
+    tradeday_df = ifc.read_mysql(query_date, session=session)
+    tradeday_df['date'] = pd.to_datetime(tradeday_df['date'])
+    ban_df = ifc.read_mysql(query_status, tradeday_df.date.min().strftime("%Y-%m-%d"),
+                            tradeday_df.date.max().strftime("%Y-%m-%d"), session=session)
+    ban_df.start_date = pd.to_datetime(ban_df.start_date)
+    ban_df.end_date = pd.to_datetime(ban_df.end_date)
+    assert len(ban_df)
+
+    assert (index.dates == tradeday_df['date'].values.astype('datetime64[D]')).all()
+    for i in range(0, len(tradeday_df), 7):
+        expected = get_ban_list(ban_df, tradeday_df, i)
+        assert sorted(index.ban_list(i).tolist()) == sorted(int(k) for k in expected)
+
+
+def test_update_adds_the_new_days(session, tmp_path):
+    full = ListingIndex(str(tmp_path / 'full.npz')).update(session.engine)
+
+    # index built before the last months, then updated with the records of the new days
+    with session.engine.begin() as con:
+        kept = con.exec_driver_sql("select * from ChangeHoldAmountSM where date > '2022-05-31'").fetchall()
+        con.exec_driver_sql("delete from ChangeHoldAmountSM where date > '2022-05-31'")
+    index = ListingIndex(str(tmp_path / 'listing.npz')).update(session.engine)
+    assert index.dates[-1] <= np.datetime64('2022-05-31')
+    with session.engine.begin() as con:
+        con.exec_driver_sql("insert into ChangeHoldAmountSM values (?, ?, ?, ?)", [tuple(r) for r in kept])
+    index = ListingIndex(str(tmp_path / 'listing.npz')).update(session.engine)
+
+    assert (index.dates == full.dates).all()
+    assert (index.codes == full.codes).all()
+    assert (index.first == full.first).all() and (index.last == full.last).all()
@@ -0,0 +1,124 @@
+import threading
+import time
+import numpy as np
+import pandas as pd
+import pytest
+import inflow_factor_class as ifc
+import main
+import session as session_module
+from job_runner import JobGuard, run_parallel
+
+strategies = ['pure', 'neu', 'absneu']
+
+
+@pytest.fixture
+def main_session(session, monkeypatch):
+    """session used by the jobs of main.py"""
+    monkeypatch.setattr(session_module, '_session', session)
+    monkeypatch.setattr(main, 'strategies', strategies)
+    return session
+
+
+def trading_days(session, start_date, end_date):
+    days = ifc.read_mysql("select distinct tradingday from jydb.QT_HKDailyQuoteIndex "
+                          "where tradingday between %s and %s order by tradingday", start_date, end_date,
+                          session=session)
+    return pd.to_datetime(days['tradingday']).dt.strftime("%Y-%m-%d").tolist()
+
+
+def test_missed_return_dates(main_session):
+    # nothing stored: from the first trading day after the first rebalancing (2021-01-08)
+    assert main.missed_return_dates('2021-01-20') == trading_days(main_session, '2021-01-09', '2021-01-20')
+
+    for date in trading_days(main_session, '2021-01-11', '2021-01-14'):
+        main.compute_return(date)
+    assert main.missed_return_dates('2021-01-20') == trading_days(main_session, '2021-01-15', '2021-01-20')
+    assert main.missed_return_dates('2021-01-14') == []
+
+
+def test_missed_rebalance_dates(main_session):
+    # last portfolios on friday 2022-07-22: the rebalancing of 2022-08-05 was missed, the run of monday 2022-08-15
+    # rebalances for the friday 2022-08-19
+    assert main.missed_rebalance_dates('2022-08-15') == ['2022-08-01', '2022-08-15']
+    assert main.missed_rebalance_dates('2022-08-01') == ['2022-08-01']
+    assert main.missed_rebalance_dates('2022-07-25') == []
+
+    with main_session.engine.begin() as con:
+        con.exec_driver_sql("delete from InflowFactor")
+    assert main.missed_rebalance_dates('2022-08-15') == ['2022-08-15']
+
+
+def test_compute_return_skips_holidays_and_raises_without_quotes(main_session, capsys):
+    calendar = ifc.get_calendar('2022-08-02', main_session)
+    weekdays = pd.bdate_range('2021-06-01', '2021-12-31').values.astype('datetime64[D]')
+    holiday = str(weekdays[~np.isin(weekdays, calendar.dates)][0])
+
+    assert main.compute_return(holiday) is None
+    assert main.compute_return('2022-08-06') is None  # saturday after the last quotes
+    assert capsys.readouterr().out.count("Not a trading day!") == 2
+
+    # wednesday after the last quotes (2022-08-02): trading not closed yet
+    with pytest.raises(ValueError):
+        main.compute_return('2022-08-03')
+    assert ifc.read_mysql("select count(*) from InflowFactorReturn", session=main_session).values[0, 0] == 0
+
+
+def test_guard_skips_a_running_job():
+    guard = JobGuard(timeout=60)
+    started, release = threading.Event(), threading.Event()
+
+    def job():
+        started.set()
+        release.wait(5)
+        return 'done'
+
+    first = threading.Thread(target=lambda: results.append(guard.run('job', job)))
+    results = []
+    first.start()
+    started.wait(5)
+    assert guard.run('job', job) is None
+    release.set()
+    first.join()
+    assert results == ['done']
+    assert guard.run('job', lambda: 'again') == 'again'
+
+
+def test_guard_makes_jobs_wait_for_each_other():
+    guard = JobGuard(timeout=5)
+    events = []
+
+    def job(name):
+        events.append(f"{name} start")
+        time.sleep(0.2)
+        events.append(f"{name} end")
+
+    threads = [threading.Thread(target=guard.run, args=(name, job, name)) for name in ['a', 'b']]
+    for t in threads:
+        t.start()
+        time.sleep(0.05)
+    for t in threads:
+        t.join()
+    assert events == ['a start', 'a end', 'b start', 'b end']
+
+    # a job waiting longer than the timeout is skipped
+    guard = JobGuard(timeout=0.1)
+    slow = threading.Thread(target=guard.run, args=('a', time.sleep, 0.5))
+    slow.start()
+    time.sleep(0.05)
+    assert guard.run('b', lambda: 'ran') is None
+    slow.join()
+
+
+def test_run_parallel_keeps_order_and_raises_after_all_items():
+    done = []
+
+    def work(i):
+        if i == 2:
+            raise KeyError(i)
+        done.append(i)
+        return i * 10
+
+    assert run_parallel(lambda i: i * 10, range(5)) == [0, 10, 20, 30, 40]
+    with pytest.raises(KeyError):
+        run_parallel(work, range(5), workers=2)
+    assert sorted(done) == [0, 1, 3, 4]
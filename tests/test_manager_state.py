@@ -0,0 +1,67 @@
+import numpy as np
+import pandas as pd
+import inflow_factor_class as ifc
+import manager_state
+from manager_state import StateManager
+
+strategies = ['pure', 'neu', 'absneu']
+columns = ['raw_ret', 'd', 'last_value', 'initial_value', 'cumulative_value', 'daily_ret']
+
+
+def trading_days(session, start_date, end_date):
+    days = ifc.read_mysql("select distinct tradingday from jydb.QT_HKDailyQuoteIndex "
+                          "where tradingday between %s and %s order by tradingday", start_date, end_date,
+                          session=session)
+    return pd.to_datetime(days['tradingday']).dt.strftime("%Y-%m-%d").tolist()
+
+
+def assert_same_returns(got, expected):
+    got = got.set_index(['strategy', 'recommendation'])[columns].sort_index().astype(float)
+    expected = expected.set_index(['strategy', 'recommendation'])[columns].sort_index().astype(float)
+    assert got.index.tolist() == expected.index.tolist()
+    np.testing.assert_allclose(got.values, expected.values, rtol=1e-9, atol=1e-12)
+
+
+def test_states_match_multi_manager(session):
+    # three rebalancing periods, returns computed from the states and uploaded every day
+    for date in trading_days(session, '2021-01-11', '2021-02-26'):
+        manager = StateManager(strategies, date, session=session)
+        assert_same_returns(manager.perf, ifc.MultiManager(strategies, date, session=session).perf)
+        assert manager.upload_mysql() == []
+
+
+def test_validate_rebuilds_a_wrong_state(session):
+    days = trading_days(session, '2021-01-11', '2021-01-29')
+    for date in days[:-1]:
+        StateManager(strategies, date, session=session).upload_mysql()
+
+    manager = StateManager(strategies, days[-1], session=session)
+    state = manager.states['neu']
+    state.last_value = {side: 2 * value for side, value in state.last_value.items()}
+    state.save()
+    manager = StateManager(strategies, days[-1], session=session, validate=True)
+    assert manager.mismatch == ['neu']
+    assert_same_returns(manager.perf, ifc.MultiManager(strategies, days[-1], session=session).perf)
+
+
+def test_state_not_saved_when_rows_fail(session, monkeypatch):
+    days = trading_days(session, '2021-01-11', '2021-01-20')
+    for date in days[:-2]:
+        StateManager(strategies, date, session=session).upload_mysql()
+
+    # the rows of the strategy pure are not stored
+    def upload_return(perf, session=None):
+        failed = perf.index[perf.strategy == 'pure']
+        ifc.upload_return(perf.drop(index=failed), session=session)
+        return [(i, 'failed') for i in failed]
+
+    monkeypatch.setattr(manager_state, 'upload_return', upload_return)
+    manager = StateManager(strategies, days[-2], session=session)
+    assert manager.upload_mysql() == ['pure']
+    assert manager.states['pure'].last_date == days[-3]
+    assert manager.states['neu'].last_date == days[-2]
+    monkeypatch.undo()
+
+    # the next day rebuilds the state of pure from the database
+    manager = StateManager(strategies, days[-1], session=session)
+    assert_same_returns(manager.perf, ifc.MultiManager(strategies, days[-1], session=session).perf)
@@ -0,0 +1,58 @@
+import mongomock
+import pandas as pd
+import pymongo
+import inflow_factor_class as ifc
+
+dates = ['2021-01-11', '2021-01-12', '2021-01-13', '2021-01-14', '2021-01-15']
+
+
+def performance(session, sink=None):
+    """performance documents of absneu (long-short and long-only) on the dates"""
+    for date in dates:
+        manager = ifc.Manager('absneu', date, session=session)
+        manager.upload_mongo(long=True, short=True, sink=sink)
+        manager.upload_mongo(long=True, short=False, sink=sink)
+
+
+def documents(coll):
+    return sorted([{k: v for k, v in doc.items() if k != '_id'} for doc in coll.find()],
+                  key=lambda doc: (doc['portfolio_id'], doc['trading_date']))
+
+
+def test_sink_matches_single_inserts(session, monkeypatch):
+    # documents inserted one by one before the sink
+    inserted = mongomock.MongoClient()['app_data']['portfolio_performance']
+    monkeypatch.setattr(ifc, 'insert_into_mongo', lambda data_dict, coll_name, session=None, sink=None:
+                        inserted.insert_one(dict(data_dict)))
+    performance(session)
+    monkeypatch.undo()
+
+    with ifc.MongoSink(batch_size=3, session=session) as sink:
+        performance(session, sink)
+    coll = sink.collection('portfolio_performance')
+    assert len(documents(inserted)) == 2 * len(dates)
+    assert documents(coll) == documents(inserted)
+
+
+def test_uploading_again_replaces_the_documents(session):
+    with ifc.MongoSink(session=session) as sink:
+        performance(session, sink)
+    first = documents(sink.collection('portfolio_performance'))
+
+    # rerun of the same dates, then a document of a date uploaded without the sink
+    with ifc.MongoSink(batch_size=4, session=session) as sink:
+        performance(session, sink)
+    ifc.Manager('absneu', dates[-1], session=session).upload_mongo(long=True, short=False)
+    assert documents(sink.collection('portfolio_performance')) == first
+
+
+def test_connection_errors_are_reported(session, monkeypatch, capsys):
+    def bulk_write(*args, **kwargs):
+        raise pymongo.errors.ServerSelectionTimeoutError("no server")
+
+    sink = ifc.MongoSink(session=session)
+    monkeypatch.setattr(sink.collection('portfolio_performance').__class__, 'bulk_write', bulk_write)
+    sink.add({'portfolio_id': 2.0, 'trading_date': dates[0]}, 'portfolio_performance')
+    sink.flush()
+    assert "Upload of 1 records into collection [portfolio_performance] failed" in capsys.readouterr().out
+    assert not sink.pending
@@ -0,0 +1,37 @@
+import numpy as np
+import pandas as pd
+import pytest
+import inflow_factor_class as ifc
+
+strategies = ['pure', 'neu', 'absneu']
+columns = ['raw_ret', 'd', 'cum_ret', 'last_value', 'initial_value', 'cumulative_value', 'daily_ret']
+
+
+def test_multi_manager_matches_manager(session):
+    days = ifc.read_mysql("select distinct tradingday from jydb.QT_HKDailyQuoteIndex "
+                          "where tradingday > '2021-01-08' and tradingday <= '2021-02-10' order by tradingday",
+                          session=session)
+    for date in pd.to_datetime(days['tradingday']).dt.strftime("%Y-%m-%d"):
+        multi = ifc.MultiManager(strategies, date, session=session)
+        for s in strategies:
+            expected = ifc.Manager(s, date, session=session).perf.set_index('recommendation').sort_index()
+            got = multi.perf[multi.perf.strategy == s].set_index('recommendation').sort_index()
+            assert got.index.tolist() == expected.index.tolist()
+            np.testing.assert_allclose(got[columns].astype(float), expected[columns].astype(float), rtol=1e-9)
+        multi.upload_mysql()
+
+
+def test_one_strategy_without_quotes_fails_all(session, capsys):
+    date = '2021-01-13'
+    # positions of pure on codes without quotes
+    with session.engine.begin() as con:
+        con.exec_driver_sql("update InflowFactor set code = code + 100000 where date = '2021-01-08' "
+                            "and strategy = 'pure'")
+
+    # the other strategies have quotes: Manager computes them, MultiManager computes none of them
+    assert not ifc.Manager('neu', date, session=session).perf.empty
+    with pytest.raises(ValueError):
+        ifc.Manager('pure', date, session=session)
+    with pytest.raises(ValueError):
+        ifc.MultiManager(strategies, date, session=session)
+    assert "No quotes of the positions of ['pure']" in capsys.readouterr().out
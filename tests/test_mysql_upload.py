@@ -0,0 +1,62 @@
+import pandas as pd
+import inflow_factor_class as ifc
+
+insert_query = """
+INSERT INTO InflowFactorReturn (`date`, `strategy`, `side`, `daily_return`, `cumulative_return`)
+    VALUES (%(date)s, %(strategy)s, %(side)s, %(daily_return)s, %(cumulative_return)s);
+"""
+
+query_stored = "select * from InflowFactorReturn order by date, strategy, side"
+
+
+def upload_rows(query, data, session):
+    """row by row upload before the batched statements"""
+    cnx = session.mysql_connection()
+    cursor = cnx.cursor()
+    cnt = 0
+    for i in range(len(data.index)):
+        try:
+            cursor.execute(query, data.iloc[i, :].to_dict())
+        except Exception as e:
+            print(e)
+            cnt += 1
+    cnx.commit()
+    cursor.close()
+    cnx.close()
+    return cnt
+
+
+def returns(dates, strategy='pure'):
+    return pd.DataFrame({'date': dates, 'strategy': strategy, 'side': 'long',
+                         'daily_return': 0.01, 'cumulative_return': 1.01})
+
+
+def test_failed_rows_are_uploaded_one_by_one(session):
+    # rows already stored and a duplicated row make the insert of their batches fail
+    ifc.replace_into_mysql(insert_query, "InflowFactorReturn", returns(['2021-01-13', '2021-01-20']), session=session)
+    data = returns(['2021-01-11', '2021-01-12', '2021-01-13', '2021-01-14', '2021-01-15', '2021-01-15',
+                    '2021-01-18', '2021-01-19', '2021-01-20'])
+    data.index = data.index + 100
+
+    cnt = upload_rows(insert_query, data, session)
+    expected = ifc.read_mysql(query_stored, session=session)
+    with session.engine.begin() as con:
+        con.exec_driver_sql("delete from InflowFactorReturn where date not in ('2021-01-13', '2021-01-20')")
+
+    failed = ifc.replace_into_mysql(insert_query, "InflowFactorReturn", data, session=session, batch_size=2)
+    assert [i for i, _ in failed] == [102, 105, 108]
+    assert len(failed) == cnt
+    assert all('UNIQUE' in e for _, e in failed)
+    pd.testing.assert_frame_equal(ifc.read_mysql(query_stored, session=session), expected)
+
+
+def test_batches_match_row_by_row_upload(session):
+    data = pd.concat([returns(pd.bdate_range('2021-01-11', periods=30).strftime("%Y-%m-%d"), s)
+                      for s in ['pure', 'neu', 'absneu']], ignore_index=True)
+    upload_rows(insert_query, data, session)
+    expected = ifc.read_mysql(query_stored, session=session)
+    with session.engine.begin() as con:
+        con.exec_driver_sql("delete from InflowFactorReturn")
+
+    assert ifc.replace_into_mysql(insert_query, "InflowFactorReturn", data, session=session, batch_size=7) == []
+    pd.testing.assert_frame_equal(ifc.read_mysql(query_stored, session=session), expected)
@@ -0,0 +1,54 @@
+import os
+import sqlite3
+import numpy as np
+import pandas as pd
+import inflow_factor_class as ifc
+from panel_store import InflowPanelStore
+
+query_window = """
+select InnerCode, sum(change_amount) as delta, avg(change_amount) as avg from AlternativeData.ChangeHoldAmountSM
+where date between %s and %s group by InnerCode
+"""
+
+query_date = """
+select date, sum(case when change_amount <> 0 then 1 else 0 end) as total from AlternativeData.ChangeHoldAmountSM
+group by date order by date
+"""
+
+
+def test_window_matches_group_by(session, tmp_path):
+    store = InflowPanelStore(str(tmp_path / 'panel')).build(session.engine)
+    for start, end in [('2021-01-04', '2021-01-15'), ('2021-06-07', '2021-06-18'), ('2022-07-18', '2022-08-02')]:
+        expected = ifc.read_mysql(query_window, start, end, session=session).sort_values('InnerCode')
+        got = store.window(start, end).sort_values('InnerCode')
+        assert got['InnerCode'].tolist() == expected['InnerCode'].astype(np.int64).tolist()
+        np.testing.assert_allclose(got['delta'], expected['delta'], rtol=1e-9)
+        np.testing.assert_allclose(got['avg'], expected['avg'], rtol=1e-9)
+
+
+def test_trading_days_match_query_date(session, tmp_path):
+    store = InflowPanelStore(str(tmp_path / 'panel')).build(session.engine)
+    expected = ifc.read_mysql(query_date, session=session)
+    got = store.trading_days()
+    assert (got['date'].values == pd.to_datetime(expected['date']).values).all()
+    assert got['total'].tolist() == expected['total'].tolist()
+
+
+def test_update_appends_new_days(session, tmp_path):
+    full = InflowPanelStore(str(tmp_path / 'full')).build(session.engine)
+
+    # panel built before the last month, then updated with the records of the new days
+    db = sqlite3.connect(os.path.join(session.path, 'AlternativeData.db'))
+    later = db.execute("select * from ChangeHoldAmountSM where Date > '2022-07-01'").fetchall()
+    db.execute("delete from ChangeHoldAmountSM where Date > '2022-07-01'")
+    db.commit()
+    path = str(tmp_path / 'panel')
+    InflowPanelStore(path).build(session.engine)
+    db.executemany("insert into ChangeHoldAmountSM values (?, ?, ?, ?)", later)
+    db.commit()
+    db.close()
+    store = InflowPanelStore(path).load().update(session.engine)
+
+    assert (store.dates == full.dates).all()
+    for start, end in [('2021-01-04', '2022-08-02'), ('2022-06-20', '2022-07-15')]:
+        pd.testing.assert_frame_equal(store.window(start, end), full.window(start, end))
@@ -0,0 +1,48 @@
+import numpy as np
+import pandas as pd
+from position_book import PositionBook
+
+
+def random_books(seed, n_codes=60):
+    rng = np.random.default_rng(seed)
+    old = pd.DataFrame({'Code': rng.choice(np.arange(1001, 1001 + n_codes), rng.integers(0, 30), replace=False)})
+    old['amount'] = rng.random(len(old))
+    new = pd.DataFrame({'Code': rng.choice(np.arange(1001, 1001 + n_codes), rng.integers(0, 30), replace=False)})
+    new['amount'] = rng.random(len(new))
+    return old, new, PositionBook(old.Code, old.amount), PositionBook(new.Code, new.amount)
+
+
+def as_frame(book):
+    return pd.DataFrame({'Code': book.codes.astype(np.int64), 'amount': book.amounts})
+
+
+def test_stay_removed_added_match_isin():
+    for seed in range(50):
+        old, new, old_book, new_book = random_books(seed)
+        expected = {
+            'stay': old[old.Code.isin(new.Code)],
+            'removed': old[~old.Code.isin(new.Code)],
+            'added': new[~new.Code.isin(old.Code)],
+        }
+        got = {'stay': old_book.stay(new_book), 'removed': old_book.removed(new_book),
+               'added': old_book.added(new_book)}
+        for name, frame in expected.items():
+            frame = frame.sort_values('Code').reset_index(drop=True)
+            pd.testing.assert_frame_equal(as_frame(got[name]), frame, check_dtype=False)
+
+        held, n_removed, n_added = old_book.diff(new_book)
+        assert n_removed == len(expected['removed']) and n_added == len(expected['added'])
+        assert np.isclose(old_book.amounts[held].sum(), expected['stay'].amount.sum())
+
+
+def test_totals_and_growth():
+    _, _, book, _ = random_books(0)
+    growth = 1 + np.random.default_rng(1).normal(0, 0.05, len(book))
+    grown = book.grow(growth)
+    assert np.isclose(grown.total(), (book.amounts * growth).sum())
+    assert len(book) > 0 and np.isclose(grown.weights().sum(), 1)
+
+    equal = PositionBook.equal([1005, 1001, 1003], 2.0)
+    assert equal.codes.tolist() == [1001, 1003, 1005] and equal.total() == 6.0
+    assert equal.isin(np.array([1003, 1004])).tolist() == [False, True, False]
+    assert len(PositionBook().stay(equal)) == 0 and len(equal.removed(PositionBook())) == 3
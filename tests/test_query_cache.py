@@ -0,0 +1,66 @@
+import time
+import pandas as pd
+import inflow_factor_class as ifc
+import query_cache
+from query_cache import QueryCache
+
+query_quote = "select InnerCode, ClosePrice from jydb.QT_HKBefRehDQuote where TradingDay = %s"
+query_inflow = "select InnerCode, change_amount from AlternativeData.ChangeHoldAmountSM where Date = %s"
+
+
+def test_read_through_matches_database(session, tmp_path):
+    cache = QueryCache(str(tmp_path / 'cache'))
+    expected = pd.read_sql(query_quote, session.engine, params=('2021-06-01',))
+    for _ in range(2):
+        pd.testing.assert_frame_equal(cache.read_sql(query_quote, session.engine, ('2021-06-01',)), expected)
+    assert cache.stats()['hits'] == 1 and cache.stats()['misses'] == 1
+
+    # read_mysql through the enabled cache, tables written by the project are never cached
+    query_cache.enable(cache)
+    try:
+        pd.testing.assert_frame_equal(ifc.read_mysql(query_quote, '2021-06-01', session=session), expected)
+        ifc.read_mysql("select count(*) from InflowFactor", session=session)
+    finally:
+        query_cache.disable()
+    assert cache.stats()['hits'] == 2 and cache.stats()['bypassed'] == 1
+
+
+def test_ttl(tmp_path):
+    cache = QueryCache(str(tmp_path / 'cache'), settle_days=7, recent_ttl=3600)
+    today = pd.Timestamp('today').normalize()
+    old, recent = (today - pd.Timedelta(days=30)).strftime("%Y-%m-%d"), today.strftime("%Y-%m-%d")
+    assert cache.ttl((old,), query_quote) is None
+    assert cache.ttl((old, recent), query_quote) == 3600
+    assert cache.ttl((), query_quote) == 3600
+    # ChangeHoldAmountSM is backfilled late: its results expire even on settled dates
+    assert cache.ttl((old,), query_inflow) == 3600
+
+
+def test_expired_results_are_read_again(tmp_path):
+    cache = QueryCache(str(tmp_path / 'cache'))
+    data = pd.DataFrame({'a': [1, 2]})
+    cache.put(query_inflow, ('2020-01-02',), data, ttl=-1)
+    assert cache.get(query_inflow, ('2020-01-02',)) is None
+    assert cache.stats()['expired'] == 1 and cache.stats()['entries'] == 0
+
+
+def test_least_recently_used_results_are_evicted(tmp_path):
+    data = pd.DataFrame({'a': range(1000)})
+    cache = QueryCache(str(tmp_path / 'cache'))
+    cache.put(query_quote, ('2020-01-01',), data)
+    size = cache.stats()['bytes']
+
+    cache = QueryCache(str(tmp_path / 'cache'), max_bytes=int(2.5 * size))
+    cache.put(query_quote, ('2020-01-02',), data)
+    time.sleep(0.01)
+    assert cache.get(query_quote, ('2020-01-01',)) is not None  # used last
+    cache.put(query_quote, ('2020-01-03',), data)
+
+    assert cache.stats()['evicted'] == 1
+    assert cache.get(query_quote, ('2020-01-02',)) is None
+    assert cache.get(query_quote, ('2020-01-01',)) is not None
+    assert cache.get(query_quote, ('2020-01-03',)) is not None
+
+    # the index is kept on disk for the next runs
+    reloaded = QueryCache(str(tmp_path / 'cache'))
+    assert reloaded.get(query_quote, ('2020-01-03',)) is not None
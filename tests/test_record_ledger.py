@@ -0,0 +1,59 @@
+import numpy as np
+import pytest
+import inflow_factor_class as ifc
+from record_ledger import RecordLedger
+
+jy_records = """SELECT count(distinct EndDate) FROM jydb.LC_SHSZHSCHoldings
+             where tradingtype=5 and infosource=72 and EndDate between %s and %s and weekday(EndDate) <=4;"""
+alter_records = "SELECT count(distinct Date) FROM ChangeHoldAmountSM where Date between %s and %s;"
+
+ranges = [('2021-01-04', '2021-01-15'), ('2021-03-01', '2021-03-31'), ('2021-06-07', '2021-06-18'),
+          ('2022-07-18', '2022-08-02'), ('2021-01-01', '2022-12-31')]
+
+
+def remove_records(session, dates):
+    with session.engine.begin() as con:
+        for date in dates:
+            con.exec_driver_sql("delete from ChangeHoldAmountSM where Date = ?", (date,))
+
+
+def test_counts_match_check_complete_records(session, tmp_path):
+    # gaps in ChangeHoldAmountSM and holdings on a weekend (not counted by the check)
+    remove_records(session, ['2021-03-10', '2021-03-11', '2022-07-29'])
+    with session.engine.begin() as con:
+        con.exec_driver_sql("insert into jydb.LC_SHSZHSCHoldings values ('2021-03-13', 5, 72)")
+
+    ledger = RecordLedger(str(tmp_path / 'ledger.npz')).update(session.engine)
+    for start_date, end_date in ranges:
+        no_jy = ifc.read_mysql(jy_records, start_date, end_date, session=session).values[0, 0]
+        no_alter = ifc.read_mysql(alter_records, start_date, end_date, session=session).values[0, 0]
+        assert ledger.counts(start_date, end_date) == (no_alter, no_jy)
+        assert ledger.is_complete(start_date, end_date) == (no_alter == no_jy)
+    assert [str(d) for d in ledger.missing('2021-03-01', '2021-03-31')] == ['2021-03-10', '2021-03-11']
+
+
+def test_check_complete_records_reports_the_missing_dates(session, capsys):
+    remove_records(session, ['2022-07-29'])
+    ifc.check_complete_records('2022-07-18', '2022-07-28', session=session)
+    with pytest.raises(ValueError):
+        ifc.check_complete_records('2022-07-18', '2022-08-02', session=session)
+    assert "Missing dates: ['2022-07-29']" in capsys.readouterr().out
+
+
+def test_update_fills_the_recent_gaps(session, tmp_path):
+    full = RecordLedger(str(tmp_path / 'full.npz')).update(session.engine)
+
+    # ledger stored while the records of the last days and of a recent day are missing
+    with session.engine.begin() as con:
+        kept = con.exec_driver_sql("select * from ChangeHoldAmountSM where Date >= '2022-07-20'").fetchall()
+    remove_records(session, sorted({r[0] for r in kept}))
+    ledger = RecordLedger(str(tmp_path / 'ledger.npz')).update(session.engine)
+    assert len(ledger.missing('2022-07-20', '2022-08-02')) == len({r[0] for r in kept})
+
+    # the records are loaded later: the update reads the dates from the first recent gap again
+    with session.engine.begin() as con:
+        con.exec_driver_sql("insert into ChangeHoldAmountSM values (?, ?, ?, ?)", [tuple(r) for r in kept])
+    ledger = RecordLedger(str(tmp_path / 'ledger.npz')).update(session.engine)
+    assert ledger.is_complete()
+    for source in full.dates:
+        assert (ledger.dates[source] == full.dates[source]).all()
@@ -0,0 +1,46 @@
+import numpy as np
+import pandas as pd
+import pytest
+from result_sink import ResultSink
+
+dates = [str(d)[:10] for d in pd.bdate_range('2021-01-04', periods=23)]
+
+
+def result(date):
+    rng = np.random.default_rng(int(date.replace('-', '')))
+    return pd.DataFrame({'date': date, 'code': np.arange(5), 'ret1': rng.normal(size=5)})
+
+
+def run(sink, stop=None):
+    """per-date loop of the analysis scripts, interrupted before the date `stop`"""
+    computed = []
+    for date in dates:
+        if sink.done(date):
+            continue
+        if date == stop:
+            raise KeyboardInterrupt
+        sink.add(date, result(date))
+        computed.append(date)
+    sink.checkpoint()
+    return computed
+
+
+def test_interrupted_run_resumes_after_the_last_checkpoint(tmp_path):
+    # results appended to one frame date by date, as before the sink
+    expected = pd.concat([result(date) for date in dates], ignore_index=True)
+
+    sink = ResultSink(str(tmp_path / 'checkpoint'), every=5)
+    with pytest.raises(KeyboardInterrupt):
+        run(sink, stop=dates[12])
+    # the results of the last two dates were not checkpointed yet
+    assert len(sink._parts()) == 2
+
+    sink = ResultSink(str(tmp_path / 'checkpoint'), every=5)
+    assert run(sink) == dates[10:]
+    pd.testing.assert_frame_equal(sink.frame(), expected)
+
+    # a finished run reads everything back, and starts from scratch after clear
+    assert run(ResultSink(str(tmp_path / 'checkpoint'), every=5)) == []
+    pd.testing.assert_frame_equal(ResultSink(str(tmp_path / 'checkpoint')).frame(), expected)
+    sink.clear()
+    assert ResultSink(str(tmp_path / 'checkpoint')).frame().empty
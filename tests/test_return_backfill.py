@@ -0,0 +1,70 @@
+import numpy as np
+import pandas as pd
+import inflow_factor_class as ifc
+import main
+import session as session_module
+from return_backfill import backfill_returns
+
+strategies = ['pure', 'neu', 'absneu']
+columns = ['raw_ret', 'd', 'cum_ret', 'last_value', 'initial_value', 'cumulative_value', 'daily_ret']
+
+
+def test_backfill_matches_daily_manager(session):
+    days = ifc.read_mysql("select distinct tradingday from jydb.QT_HKDailyQuoteIndex "
+                          "where tradingday > '2021-01-08' and tradingday <= '2021-03-31' order by tradingday",
+                          session=session)
+    days = pd.to_datetime(days['tradingday']).dt.strftime("%Y-%m-%d")
+
+    # day-by-day returns, each day uploaded before the next one is computed
+    daily = []
+    for date in days:
+        for s in strategies:
+            manager = ifc.Manager(s, date, session=session)
+            manager.upload_mysql()
+            daily.append(manager.perf.assign(strategy=s))
+    daily = pd.concat(daily, ignore_index=True)
+
+    perf = backfill_returns(days.iloc[0], days.iloc[-1], strategies, session=session)
+    merged = pd.merge(daily, perf, on=['date', 'strategy', 'recommendation'], how='outer', indicator=True)
+    assert (merged['_merge'] == 'both').all()
+    for col in columns:
+        np.testing.assert_allclose(merged[col + '_y'], merged[col + '_x'].astype(float), rtol=1e-9, atol=1e-12)
+
+
+def test_catch_up_continues_stored_returns(session, monkeypatch):
+    monkeypatch.setattr(session_module, '_session', session)
+    monkeypatch.setattr(main, 'strategies', strategies)
+    days = ifc.read_mysql("select distinct tradingday from jydb.QT_HKDailyQuoteIndex "
+                          "where tradingday > '2021-01-08' and tradingday <= '2021-02-12' order by tradingday",
+                          session=session)
+    days = pd.to_datetime(days['tradingday']).dt.strftime("%Y-%m-%d").tolist()
+    stored, missed = days[:12], days[12:]
+
+    # stored returns that differ from a recomputation (e.g. computed from quotes corrected since)
+    for date in stored:
+        for s in strategies:
+            ifc.Manager(s, date, session=session).upload_mysql()
+    with session.engine.begin() as con:
+        con.exec_driver_sql("update InflowFactorReturn set cumulative_return = round(cumulative_return * 1.1, 4)")
+
+    # reference: day by day on top of the stored rows
+    daily = []
+    for date in missed:
+        for s in strategies:
+            manager = ifc.Manager(s, date, session=session)
+            manager.upload_mysql()
+            daily.append(manager.perf.assign(strategy=s))
+    daily = pd.concat(daily, ignore_index=True)
+    with session.engine.begin() as con:
+        con.exec_driver_sql(f"delete from InflowFactorReturn where date >= '{missed[0]}'")
+
+    assert main.missed_return_dates(missed[-1]) == missed
+    main.compute_returns(missed)
+    got = ifc.read_mysql("select date, strategy, side as recommendation, daily_return, cumulative_return "
+                         "from InflowFactorReturn where date >= %s", missed[0], session=session)
+
+    got['date'] = pd.to_datetime(got['date']).dt.strftime("%Y-%m-%d")
+    merged = pd.merge(daily, got, on=['date', 'strategy', 'recommendation'], how='outer', indicator=True)
+    assert (merged['_merge'] == 'both').all()
+    np.testing.assert_allclose(merged['cumulative_return'], merged['cumulative_value'].astype(float).round(4))
+    np.testing.assert_allclose(merged['daily_return'], merged['daily_ret'].astype(float).round(4))
@@ -0,0 +1,66 @@
+import numpy as np
+import pandas as pd
+import inflow_factor_class as ifc
+from trading_calendar import TradingCalendar
+
+query_last_trading = """
+select min(tradingday) from jydb.QT_HKDailyQuoteIndex where tradingday between %s and %s
+"""
+
+query_days = "select distinct tradingday from jydb.QT_HKDailyQuoteIndex where tradingday between %s and %s"
+
+ref_dates = ['2021-01-08', '2021-01-10', '2021-03-05', '2021-07-19', '2022-03-04', '2022-08-02', '2022-08-12']
+
+
+def test_window_start_matches_query_last_trading(session, tmp_path):
+    calendar = TradingCalendar(path=str(tmp_path / 'calendar.npy')).update(session.engine)
+    for ref_date in ref_dates:
+        start_date = str(pd.to_datetime(ref_date).normalize() - np.timedelta64(13, "D"))[:10]
+        expected = ifc.read_mysql(query_last_trading, start_date, ref_date, session=session).values[0, 0]
+        got = calendar.window_start(ref_date)
+        if pd.isna(expected):
+            assert np.isnat(got)
+        else:
+            assert got == pd.Timestamp(expected).to_datetime64().astype('datetime64[D]')
+
+    # arrays of dates give the same days
+    got = calendar.window_start(ref_dates)
+    assert [str(d) for d in got] == [str(calendar.window_start(d)) for d in ref_dates]
+
+
+def test_date_arithmetic_matches_the_days(session, tmp_path):
+    calendar = TradingCalendar(path=str(tmp_path / 'calendar.npy')).update(session.engine)
+    days = pd.to_datetime(ifc.read_mysql(query_days, '1900-01-01', '2100-01-01', session=session)['tradingday'])
+    days = np.sort(days.values.astype('datetime64[D]'))
+    assert (calendar.dates == days).all()
+
+    for ref_date in ref_dates[:-1]:
+        d = np.datetime64(ref_date, 'D')
+        i = np.searchsorted(days, d, side='right') - 1
+        assert calendar.previous(ref_date) == days[i]
+        assert calendar.is_trading_day(ref_date) == (days[i] == d)
+        assert calendar.next(ref_date) == days[np.searchsorted(days, d, side='left')]
+        # nat outside the calendar
+        assert str(calendar.shift(ref_date, -5)) == (str(days[i - 5]) if i >= 5 else 'NaT')
+        assert str(calendar.shift(ref_date, 3)) == (str(days[i + 3]) if i + 3 < len(days) else 'NaT')
+        between = ifc.read_mysql(query_days, '2021-06-01', ref_date, session=session)['tradingday']
+        assert (calendar.between('2021-06-01', ref_date) == np.sort(pd.to_datetime(between).values
+                                                                     .astype('datetime64[D]'))).all()
+
+
+def test_update_adds_the_new_days(session, tmp_path):
+    full = TradingCalendar(path=str(tmp_path / 'full.npy')).update(session.engine)
+
+    # calendar stored before the last month, then refreshed when a later date is requested
+    with session.engine.begin() as con:
+        kept = con.exec_driver_sql("select * from jydb.QT_HKDailyQuoteIndex where tradingday > '2022-06-30'") \
+            .fetchall()
+        con.exec_driver_sql("delete from jydb.QT_HKDailyQuoteIndex where tradingday > '2022-06-30'")
+    calendar = TradingCalendar(path=str(tmp_path / 'calendar.npy')).ensure('2022-06-30', session.engine)
+    assert calendar.dates[-1] <= np.datetime64('2022-06-30')
+    with session.engine.begin() as con:
+        con.exec_driver_sql("insert into jydb.QT_HKDailyQuoteIndex values (?, ?, ?)", [tuple(r) for r in kept])
+    calendar = TradingCalendar(path=str(tmp_path / 'calendar.npy')).ensure('2022-06-30', session.engine)
+    assert calendar.dates[-1] <= np.datetime64('2022-06-30')
+    calendar = TradingCalendar(path=str(tmp_path / 'calendar.npy')).ensure('2022-08-02', session.engine)
+    assert (calendar.dates == full.dates).all()
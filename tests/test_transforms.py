@@ -0,0 +1,89 @@
+import numpy as np
+import pandas as pd
+import scipy.stats
+import transforms
+
+
+def winsorize(array, sig):
+    """winsorize of inflow_factor_class before the transform kernels"""
+    before_mean = np.mean(array)
+    before_std = np.std(array)
+    win = lambda x: before_mean - sig * before_std if x < before_mean - sig * before_std else (
+        before_mean + sig * before_std if x > before_mean + sig * before_std else x)
+    return array.apply(win)
+
+
+def standaradize(array):
+    return (array - np.mean(array)) / np.std(array)
+
+
+def grouping(x, size=5):
+    return int(x * size) + 1 if x < 1 else size
+
+
+def panel(n_dates=12, n_stocks=40, seed=0):
+    """long table of dates x stocks with heavy tails, ties and missing values"""
+    rng = np.random.default_rng(seed)
+    df = pd.DataFrame({'date': np.repeat(np.arange(n_dates), n_stocks),
+                       'pure': rng.standard_t(3, n_dates * n_stocks),
+                       'mktcap': np.exp(rng.normal(22, 1.5, n_dates * n_stocks))})
+    df.loc[rng.random(len(df)) < 0.1, 'pure'] = np.nan
+    df.loc[rng.random(len(df)) < 0.1, 'pure'] = 0.5
+    return df.sample(frac=1, random_state=seed)
+
+
+def by_date(df, func):
+    return pd.concat([func(g) for _, g in df.groupby('date')]).reindex(df.index)
+
+
+def test_winsorize_and_zscore_match_the_pandas_functions():
+    df = panel()
+    valid = df.dropna(subset=['pure'])
+    got = transforms.winsorize(df['pure'], 3.5, groups=df['date'])
+    expected = by_date(valid, lambda g: winsorize(g['pure'], 3.5))
+    np.testing.assert_allclose(got[valid.index], expected, rtol=1e-12)
+    assert got[df['pure'].isna()].isna().all()
+
+    got = transforms.zscore(df['pure'], groups=df['date'])
+    expected = by_date(valid, lambda g: standaradize(g['pure']))
+    np.testing.assert_allclose(got[valid.index], expected, rtol=1e-12)
+
+
+def test_rank_and_buckets_match_pandas_rank():
+    df = panel()
+    got = transforms.pct_rank(df['pure'], groups=df['date'])
+    expected = df.groupby('date')['pure'].rank(pct=True)
+    pd.testing.assert_series_equal(got, expected, check_names=False)
+
+    got = transforms.quantile_bucket(df['pure'], 5, groups=df['date'])
+    valid = df['pure'].notna()
+    assert (got[valid] == expected[valid].apply(grouping)).all()
+    got = transforms.quantile_bucket(df['mktcap'], 3, groups=df['date'])
+    assert (got == df.groupby('date')['mktcap'].rank(pct=True).apply(grouping, args=(3,))).all()
+
+
+def test_residualize_matches_linregress():
+    df = panel().dropna()
+    got = transforms.residualize(df['pure'], np.log(df['mktcap']), groups=df['date'])
+    for _, g in df.groupby('date'):
+        slope, intercept, *_ = scipy.stats.linregress(np.log(g['mktcap']), g['pure'])
+        np.testing.assert_allclose(got[g.index], g['pure'] - intercept - slope * np.log(g['mktcap']), atol=1e-12)
+
+
+def test_panels_match_long_tables():
+    # rows of a 2-d panel are the groups; masked entries are left out like missing ones
+    df = panel().sort_values('date', kind='stable')
+    values = df['pure'].values.reshape(12, 40).astype(np.float32)
+    mask = np.broadcast_to(np.arange(40)[None, :] < 35, values.shape)
+    for func in [lambda v, **kw: transforms.winsorize(v, 3.5, **kw), transforms.zscore, transforms.pct_rank]:
+        got = func(values, mask=mask)
+        expected = func(np.where(mask, values, np.nan).ravel(), groups=np.repeat(np.arange(12), 40))
+        assert got.dtype == np.float32
+        np.testing.assert_allclose(got.ravel(), expected, rtol=1e-6, equal_nan=True)
+
+
+def test_empty_values():
+    # e.g. a period without positions in the return backfill
+    assert transforms.pct_rank(np.array([])).shape == (0,)
+    assert transforms.pct_rank(pd.Series([np.nan, np.nan]), groups=[1, 2]).isna().all()
+    assert transforms.quantile_bucket(np.empty((0, 5))).shape == (0, 5)
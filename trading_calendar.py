@@ -0,0 +1,132 @@
+"""
+this module defines the calendar of hong kong trading days (jydb.QT_HKDailyQuoteIndex);
+trading days are loaded once, stored on disk and refreshed with the new days only,
+date arithmetic (shift by k trading days, first trading day of a window, rebalancing dates) is done with
+searchsorted on the sorted days and works on single dates as well as arrays of dates
+"""
+import os
+import threading
+import numpy as np
+import pandas as pd
+
+default_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'hk_calendar.npy')
+
+query_calendar = """
+select distinct tradingday from jydb.QT_HKDailyQuoteIndex where tradingday > %s
+"""
+
+# portfolios are rebalanced every two weeks on friday, starting from this date
+rebalance_anchor = np.datetime64('2022-03-04', 'D')
+rebalance_days = 14
+
+
+def _days(dates):
+    """date (string, timestamp) or array of dates as datetime64[D]"""
+    if np.ndim(dates) == 0:
+        return pd.Timestamp(dates).to_datetime64().astype('datetime64[D]')
+    return pd.DatetimeIndex(dates).values.astype('datetime64[D]')
+
+
+class TradingCalendar:
+    """sorted trading days (datetime64[D]), results are nat where no trading day satisfies the request"""
+
+    def __init__(self, dates=None, path=default_path):
+        self.path = path
+        self.dates = np.array([], dtype='datetime64[D]') if dates is None else np.unique(_days(dates))
+
+    @classmethod
+    def from_dates(cls, dates):
+        """calendar of the given days (e.g. the southbound trading days of the inflow panel)"""
+        return cls(dates, path=None)
+
+    def exists(self):
+        return self.path is not None and os.path.exists(self.path)
+
+    def load(self):
+        self.dates = np.load(self.path)
+        return self
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        # temporary file of this thread, so concurrent saves never replace the file with a partial one
+        tmp = f"{self.path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp, 'wb') as f:
+            np.save(f, self.dates)
+        os.replace(tmp, self.path)
+
+    def update(self, con, overlap=5):
+        """
+        add the trading days after the last stored days (all of them if the calendar is not stored yet),
+        con is any connection accepted by pd.read_sql
+        """
+        if self.exists():
+            self.load()
+        keep = max(len(self.dates) - overlap, 0)
+        since = str(self.dates[keep - 1]) if keep > 0 else '1900-01-01'
+        new = pd.read_sql(query_calendar, con, params=(since,))
+        self.dates = np.union1d(self.dates[:keep], _days(new['tradingday']))
+        self.save()
+        return self
+
+    def ensure(self, date, con):
+        """load the stored calendar and refresh it only if it ends before date"""
+        if self.exists():
+            self.load()
+        if not len(self.dates) or self.dates[-1] < _days(date):
+            self.update(con)
+        return self
+
+    def _take(self, pos):
+        """trading days at the positions, nat outside the calendar"""
+        dates = np.append(self.dates, np.datetime64('NaT', 'D'))
+        pos = np.asarray(pos)
+        return dates[np.where((pos >= 0) & (pos < len(self.dates)), pos, len(self.dates))][()]
+
+    def is_trading_day(self, dates):
+        return self.previous(dates) == _days(dates)
+
+    def previous(self, dates):
+        """last trading day on or before each date"""
+        return self._take(np.searchsorted(self.dates, _days(dates), side='right') - 1)
+
+    def next(self, dates):
+        """first trading day on or after each date"""
+        return self._take(np.searchsorted(self.dates, _days(dates), side='left'))
+
+    def shift(self, dates, k):
+        """trading day k trading days after (k < 0: before) the last trading day on or before each date"""
+        return self._take(np.searchsorted(self.dates, _days(dates), side='right') - 1 + k)
+
+    def window_start(self, ref_dates, days=14):
+        """
+        first trading day of the `days` calendar days ending on each reference date
+        (same as min(tradingday) between ref_date - (days - 1) days and ref_date)
+        """
+        ref = _days(ref_dates)
+        start = self.next(ref - np.timedelta64(days - 1, 'D'))
+        return np.where(start <= ref, start, np.datetime64('NaT', 'D'))[()]
+
+    def between(self, start_date, end_date):
+        """trading days between start_date and end_date (both inclusive)"""
+        i = np.searchsorted(self.dates, _days(start_date), side='left')
+        j = np.searchsorted(self.dates, _days(end_date), side='right')
+        return self.dates[i:j]
+
+    @staticmethod
+    def previous_rebalance(dates):
+        """last scheduled rebalancing friday strictly before each date"""
+        d = _days(dates)
+        k = (d - rebalance_anchor - np.timedelta64(1, 'D')).astype(np.int64) // rebalance_days
+        return (rebalance_anchor + k * np.timedelta64(rebalance_days, 'D'))[()]
+
+    @staticmethod
+    def next_rebalance(dates):
+        """
+        scheduled rebalancing friday after the friday of each date's week
+        (portfolios are dated on the friday of the week, see Selector.select_stocks)
+        """
+        d = _days(dates)
+        weekday = (d.astype(np.int64) + 3) % 7  # 1970-01-01 is a thursday
+        friday = d + (4 - weekday).astype('timedelta64[D]')
+        k = (friday - rebalance_anchor).astype(np.int64) // rebalance_days + 1
+        return (rebalance_anchor + k * np.timedelta64(rebalance_days, 'D'))[()]
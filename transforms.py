@@ -0,0 +1,122 @@
+"""
+this module defines cross-sectional transforms (winsorize, standardize, percentage rank, quantile buckets and
+regression residuals) that work on a whole panel at once;
+values are either a 1-d array/series with a group label for each entry (e.g. the date column of a long table)
+or a 2-d array whose rows are the groups (dates x stocks);
+nan entries and entries outside the optional mask are left out of the statistics and returned as nan,
+statistics are accumulated in float64 and results keep the float dtype of the input (e.g. float32)
+"""
+import numpy as np
+import pandas as pd
+
+
+def _prepare(values, groups=None, mask=None):
+    """flatten values into a float64 array with an integer group code and a validity flag for each entry"""
+    arr = np.asarray(values)
+    x = arr.astype(np.float64).ravel()
+    if groups is not None:
+        g, uniques = pd.factorize(np.asarray(groups).ravel())
+        n = len(uniques)
+    elif arr.ndim == 2:
+        g = np.repeat(np.arange(arr.shape[0]), arr.shape[1])
+        n = arr.shape[0]
+    else:
+        g = np.zeros(len(x), dtype=np.intp)
+        n = 1
+    valid = ~np.isnan(x) & (g >= 0)
+    if mask is not None:
+        valid &= np.asarray(mask, dtype=bool).ravel()
+
+    dtype = arr.dtype if arr.dtype.kind == 'f' else np.dtype(np.float64)
+    if isinstance(values, pd.Series):
+        meta = (arr.shape, dtype, values.index, values.name)
+    else:
+        meta = (arr.shape, dtype, None, None)
+    return x, g, n, valid, meta
+
+
+def _restore(x, valid, meta):
+    """put results back into the shape and type of the input"""
+    shape, dtype, index, name = meta
+    x = np.where(valid, x, np.nan).reshape(shape).astype(dtype, copy=False)
+    if index is not None:
+        return pd.Series(x, index=index, name=name)
+    return x
+
+
+def _group_mean_std(x, g, n, valid):
+    """mean and (population) std of each group"""
+    gv, xv = g[valid], x[valid]
+    cnt = np.bincount(gv, minlength=n)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = np.bincount(gv, weights=xv, minlength=n) / cnt
+        std = np.sqrt(np.bincount(gv, weights=(xv - mean[gv]) ** 2, minlength=n) / cnt)
+    return mean, std
+
+
+def winsorize(values, sig, groups=None, mask=None):
+    """
+    winsorize the values of each group given the significance:
+    for values > mean + sig*std, values = mean + sig*std,
+    for value < mean - sig*std, values = mean - sig*std
+    """
+    x, g, n, valid, meta = _prepare(values, groups, mask)
+    mean, std = _group_mean_std(x, g, n, valid)
+    with np.errstate(invalid='ignore'):
+        x = np.clip(x, (mean - sig * std)[g], (mean + sig * std)[g])
+    return _restore(x, valid, meta)
+
+
+def zscore(values, groups=None, mask=None):
+    """standardize the values of each group"""
+    x, g, n, valid, meta = _prepare(values, groups, mask)
+    mean, std = _group_mean_std(x, g, n, valid)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        x = (x - mean[g]) / std[g]
+    return _restore(x, valid, meta)
+
+
+def pct_rank(values, groups=None, mask=None):
+    """percentage rank within each group, same as pandas rank(pct=True) (ties get the average rank)"""
+    x, g, n, valid, meta = _prepare(values, groups, mask)
+    pos = np.flatnonzero(valid)
+    order = pos[np.lexsort((x[pos], g[pos]))]
+    xs, gs = x[order], g[order]
+
+    # ordinal rank within the group
+    new_group = np.r_[True, gs[1:] != gs[:-1]][:len(order)]
+    group_start = np.maximum.accumulate(np.where(new_group, np.arange(len(order)), 0))
+    rank = np.arange(len(order)) - group_start + 1.0
+
+    # average rank of tied values
+    new_run = new_group | np.r_[True, xs[1:] != xs[:-1]][:len(order)]
+    run = np.cumsum(new_run) - 1
+    rank = (np.bincount(run, weights=rank) / np.bincount(run))[run]
+
+    out = np.full(len(x), np.nan)
+    out[order] = rank / np.bincount(gs, minlength=n)[gs]
+    return _restore(out, valid, meta)
+
+
+def quantile_bucket(values, size=5, groups=None, mask=None):
+    """bucket number (1, ..., size) of the percentage rank within each group, bucket 1 has the smallest values"""
+    rank = np.asarray(pct_rank(values, groups, mask), dtype=np.float64)
+    x, _, _, valid, meta = _prepare(values, groups, mask)
+    bucket = np.where(rank < 1, np.floor(rank * size) + 1, size)
+    return _restore(bucket.ravel(), valid, meta)
+
+
+def residualize(y, x, groups=None, mask=None):
+    """residual of the ols regression y = intercept + slope * x within each group (same as scipy.stats.linregress)"""
+    yv, g, n, valid, meta = _prepare(y, groups, mask)
+    xv = np.asarray(x, dtype=np.float64).ravel()
+    valid &= ~np.isnan(xv)
+    x_mean, _ = _group_mean_std(xv, g, n, valid)
+    y_mean, _ = _group_mean_std(yv, g, n, valid)
+    dx = np.where(valid, xv - x_mean[g], 0)
+    dy = np.where(valid, yv - y_mean[g], 0)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        slope = np.bincount(g[valid], weights=(dx * dy)[valid], minlength=n) / \
+            np.bincount(g[valid], weights=(dx ** 2)[valid], minlength=n)
+        intercept = y_mean - slope * x_mean
+    return _restore(yv - intercept[g] - slope[g] * xv, valid, meta)